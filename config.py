@@ -7,3 +7,10 @@ class Config:
     UNINSTALL_EXECUTABLE_NAME = "Uninstall Wuthering Waves RPC.exe"
     APPLICATION_ID = "1243855663210303488"
     WUWA_PROCESS_NAME = "Wuthering Waves.exe"
+    WUWA_CLIENT_PROCESS_NAME = "Client-Win64-Shipping.exe"
+    WUWA_LAUNCHER_PROCESS_NAME = "launcher.exe"
+    DISCORD_PROCESS_NAMES = ["Discord.exe", "DiscordPTB.exe", "DiscordCanary.exe"]
+    UPDATE_INTERVAL = 15
+    NOTIFIED_UPDATE_INTERVAL = 300
+    CONNECTION_CHECK_INTERVAL = 15
+    THROTTLED_INTERVAL_MULTIPLIER = 4
@@ -0,0 +1,119 @@
+"""
+Benchmark the presence publish path end-to-end against a fake Discord client.
+
+Run with `python -m src.bin.benchmark`. Only Linux and macOS are supported, as
+the fake server is found through a private `$XDG_RUNTIME_DIR`
+"""
+
+import os
+from argparse import ArgumentParser
+from statistics import median, quantiles
+from tempfile import TemporaryDirectory
+from time import monotonic
+
+from src.bin.fake_discord import FakeDiscordServer
+from src.utilities.rpc import Activity, DiscordDisconnectedError, Presence
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=1000, help="updates to send")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="server latency in seconds"
+    )
+    parser.add_argument(
+        "--rate-limit-every",
+        type=int,
+        default=0,
+        help="reject every Nth update with a rate limit error",
+    )
+    parser.add_argument(
+        "--disconnect-every",
+        type=int,
+        default=0,
+        help="drop the connection after every N updates",
+    )
+    parser.add_argument(
+        "--clients", type=int, default=1, help="fake Discord clients to run"
+    )
+    parser.add_argument(
+        "--slow-client-latency",
+        type=float,
+        default=None,
+        help="latency of the last client in seconds, if different",
+    )
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+        # Make sure pypresence can only find the fake servers
+        os.environ["XDG_RUNTIME_DIR"] = directory
+
+        servers = [
+            FakeDiscordServer(FakeDiscordServer.ipc_path(directory, pipe), args.latency)
+            for pipe in range(args.clients)
+        ]
+        if args.slow_client_latency is not None:
+            servers[-1].latency = args.slow_client_latency
+
+        for server in servers:
+            server.start()
+            server.wait_until_ready()
+
+        # Faults are injected into the first client only
+        server = servers[0]
+
+        presence = Presence(
+            {
+                "wuwa_install_location": directory,
+                "using_steam_version": False,
+                "database_access_preference": False,
+                "keep_running_preference": False,
+                "promote_preference": False,
+            }
+        )
+
+        latencies = []
+        reconnects = []
+        started_at = monotonic()
+
+        for i in range(args.count):
+            if not presence.discord.connected:
+                reconnect_started_at = monotonic()
+                presence.discord.connect()
+                presence.publisher.reset()
+                reconnects.append(monotonic() - reconnect_started_at)
+
+            if args.rate_limit_every and i % args.rate_limit_every == 0:
+                server.rate_limit()
+            if args.disconnect_every and i % args.disconnect_every == 0 and i:
+                server.disconnect(after=1)
+
+            activity = Activity.create(start=started_at, details=f"Update {i}")
+            update_started_at = monotonic()
+            try:
+                presence.publisher.publish(activity)
+            except DiscordDisconnectedError:
+                pass
+            latencies.append(monotonic() - update_started_at)
+
+        elapsed = monotonic() - started_at
+        presence.discord.close()
+        for server in servers:
+            server.stop()
+
+    print(f"updates:     {args.count} in {elapsed:.2f}s")
+    print(f"throughput:  {args.count / elapsed:.1f} updates/s")
+    print(f"latency p50: {median(latencies) * 1000:.2f}ms")
+    print(f"latency p95: {quantiles(latencies, n=20)[-1] * 1000:.2f}ms")
+    print(f"latency max: {max(latencies) * 1000:.2f}ms")
+    for pipe, server in enumerate(servers):
+        print(
+            f"discord-ipc-{pipe}: {len(server.activities)} received, {server.connections} connections"
+        )
+    print(f"rejected:    {presence.publisher.rejected}")
+    if reconnects:
+        print(f"reconnect:   {median(reconnects) * 1000:.2f}ms median")
+
+
+if __name__ == "__main__":
+    main()
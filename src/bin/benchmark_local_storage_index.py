@@ -0,0 +1,106 @@
+"""
+Benchmark selecting the player's LocalStorage file among synthetic databases,
+comparing serial scoring with scoring on the thread pool.
+
+Run with `python -m src.bin.benchmark_local_storage_index`. Every selection
+starts from an empty index, so every file is scored. `--latency` adds a delay
+to opening each file, standing in for a slow or network drive
+"""
+
+import os
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+
+from src.bin.fake_local_storage import create_local_storage
+from src.utilities.rpc import LocalStorageIndex
+
+KURO_GAMES_UID = "999999999"
+
+
+class SlowLocalStorageIndex(LocalStorageIndex):
+    """
+    A LocalStorage index on a drive that takes `latency` seconds to open a file
+    """
+
+    latency: float = 0.0
+
+    def _score(self, path: str) -> int | None:
+        sleep(self.latency)
+        return super()._score(path)
+
+
+def measure(directory: str, workers: int, latency: float, repeats: int) -> float:
+    """
+    Time a selection from an empty index, checking the right file is selected
+
+    :param directory: The LocalStorage directory
+    :param workers: The number of files to score at the same time
+    :param latency: The delay to add to opening each file
+    :param repeats: The number of selections to time
+    :return: The median time per selection in seconds
+    """
+    times = []
+
+    for _ in range(repeats):
+        index = SlowLocalStorageIndex(KURO_GAMES_UID, True, workers)
+        index.latency = latency
+
+        started_at = perf_counter()
+        selected = index.select(directory)
+        times.append(perf_counter() - started_at)
+        index.close()
+
+        if selected != "0.db":
+            raise RuntimeError(f"Selected the wrong file: {selected}")
+
+    return sorted(times)[len(times) // 2]
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--databases",
+        type=int,
+        nargs="+",
+        default=[1, 8, 64],
+        help="database files in each run",
+    )
+    parser.add_argument(
+        "--uids", type=int, default=1000, help="UIDs in each database's level data"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="files to score at the same time"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.01,
+        help="seconds added to opening each file",
+    )
+    parser.add_argument("--repeats", type=int, default=5, help="selections to time")
+    args = parser.parse_args()
+
+    print(f"{'files':>6} {'serial':>10} {'parallel':>10} {'speedup':>8}")
+
+    for databases in args.databases:
+        with TemporaryDirectory() as directory:
+            # The player's highest union level is in the first file
+            for i in range(databases):
+                create_local_storage(
+                    os.path.join(directory, f"{i}.db"),
+                    args.uids,
+                    KURO_GAMES_UID,
+                    level=90 - i % 90,
+                )
+
+            serial = measure(directory, 1, args.latency, args.repeats)
+            parallel = measure(directory, args.workers, args.latency, args.repeats)
+
+        print(
+            f"{databases:>6} {serial * 1000:>8.1f}ms {parallel * 1000:>8.1f}ms {serial / parallel:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
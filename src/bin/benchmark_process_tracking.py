@@ -0,0 +1,80 @@
+"""
+Benchmark finding the game in a large synthetic process table, comparing a
+full scan on every check with the PID-pinned tracker.
+
+Run with `python -m src.bin.benchmark_process_tracking`. Lookups are the
+number of per-process queries made, each of which costs at least one syscall
+with psutil
+"""
+
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Callable
+
+from psutil import NoSuchProcess
+
+from config import Config
+from src.bin.fake_process_table import FakeProcessTable
+from src.utilities.rpc import ProcessScanner, ProcessTracker
+
+
+def measure(
+    table: FakeProcessTable, check: Callable[[], bool], checks: int
+) -> tuple[float, float]:
+    """
+    Time a check
+
+    :param table: The process table the check uses
+    :param check: The check to time
+    :param checks: The number of times to run the check
+    :return: The mean time per check in seconds, and the mean lookups per check
+    """
+    lookups = table.lookups
+    started_at = perf_counter()
+
+    for _ in range(checks):
+        if not check():
+            raise RuntimeError("The game was not found")
+
+    elapsed = perf_counter() - started_at
+    return elapsed / checks, (table.lookups - lookups) / checks
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--processes", type=int, default=5000, help="processes in the table"
+    )
+    parser.add_argument("--checks", type=int, default=100, help="checks to time")
+    args = parser.parse_args()
+
+    table = FakeProcessTable(args.processes)
+    # Put the game at the end of the table, like a game started after boot
+    table.spawn(Config.WUWA_PROCESS_NAME)
+
+    def name_every_pid() -> bool:
+        # What the RPC used to do: look up the name of every PID
+        for process in table.process_iter():
+            try:
+                if process.name() == Config.WUWA_PROCESS_NAME:
+                    return True
+            except NoSuchProcess:
+                pass
+        return False
+
+    scanner = ProcessScanner([Config.WUWA_PROCESS_NAME], table.process_iter)
+    tracker = ProcessTracker(Config.WUWA_PROCESS_NAME, scanner, table.Process)
+    tracker.is_running()
+
+    print(f"processes: {len(table.processes)}")
+    for name, check in (
+        ("name every PID", name_every_pid),
+        ("full scan", lambda: Config.WUWA_PROCESS_NAME in scanner.scan()),
+        ("pinned tracker", tracker.is_running),
+    ):
+        seconds, lookups = measure(table, check, args.checks)
+        print(f"{name:15} {seconds * 1000:8.3f}ms {lookups:8.0f} lookups per check")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark reading the player's level data from synthetic LocalStorage
+databases, comparing the JSON1 query with parsing the document in Python.
+
+Run with `python -m src.bin.benchmark_sdk_level_data`. The player's UID is the
+last one in the document, which is the worst case for both paths
+"""
+
+import os
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+
+from src.bin.fake_local_storage import create_local_storage
+from src.utilities.rpc import SdkLevelDataCache, get_database
+from src.utilities.rpc.database import _has_json1, _query_sdk_level_data
+
+KURO_GAMES_UID = "999999999"
+
+
+def measure(read: Callable[[], dict | None], repeats: int) -> float:
+    """
+    Time a read, checking it finds the player
+
+    :param read: The read to time
+    :param repeats: The number of times to run it
+    :return: The median time per read in seconds
+    """
+    times = []
+
+    for _ in range(repeats):
+        started_at = perf_counter()
+        level_data = read()
+        times.append(perf_counter() - started_at)
+
+        if level_data is None or level_data["Level"] != 50:
+            raise RuntimeError(f"Read the wrong level data: {level_data}")
+
+    return sorted(times)[len(times) // 2]
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--uids",
+        type=int,
+        nargs="+",
+        default=[1000, 5000, 10000, 50000],
+        help="UIDs in the level data of each database",
+    )
+    parser.add_argument("--repeats", type=int, default=20, help="reads to time")
+    args = parser.parse_args()
+
+    print(f"{'UIDs':>8} {'JSON1':>10} {'Python':>10} {'cached':>10}")
+
+    with TemporaryDirectory() as directory:
+        for uids in args.uids:
+            path = os.path.join(directory, f"{uids}.db")
+            create_local_storage(path, uids, KURO_GAMES_UID)
+            connection = get_database(path, read_only=True)
+
+            if not _has_json1(connection):
+                raise SystemExit("The sqlite library has no JSON1 support")
+
+            def read_raw() -> str:
+                return connection.execute(
+                    "SELECT value FROM LocalStorage WHERE key = ?", ("SdkLevelData",)
+                ).fetchone()[0]
+
+            def parse() -> dict | None:
+                # A new cache every time, so the document is always parsed
+                return SdkLevelDataCache().get(read_raw(), KURO_GAMES_UID)
+
+            cache = SdkLevelDataCache()
+
+            def parse_cached() -> dict | None:
+                return cache.get(read_raw(), KURO_GAMES_UID)
+
+            json1 = measure(
+                lambda: _query_sdk_level_data(connection, KURO_GAMES_UID),
+                args.repeats,
+            )
+            python = measure(parse, args.repeats)
+            cached = measure(parse_cached, args.repeats)
+            connection.close()
+
+            print(
+                f"{uids:>8} {json1 * 1000:>8.2f}ms {python * 1000:>8.2f}ms {cached * 1000:>8.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Check that the process watcher reports the game starting and exiting, using a
+fake process table.
+
+Run with `python -m src.bin.check_process_watcher`. The watcher polls at its
+default intervals, as the RPC does, so the start events check the real start
+latency. Exits with a non-zero status if an event is missing or late
+"""
+
+import sys
+from argparse import ArgumentParser
+from threading import Event
+from time import monotonic
+
+from config import Config
+from src.bin.fake_process_table import FakeProcessTable
+from src.utilities.rpc import ProcessScanner, ProcessTracker, ProcessWatcher
+
+
+def expect(
+    description: str, event: Event, timeout: float, happens: bool = True
+) -> bool:
+    """
+    Wait for an event and report whether it came in time, or stayed away
+
+    :param description: What is being checked
+    :param event: The event to wait for
+    :param timeout: The longest to wait in seconds
+    :param happens: Whether the event is expected at all
+    :return: True if the event came in time, or didn't come if not expected
+    """
+    started_at = monotonic()
+    ok = event.wait(timeout) == happens
+    elapsed = monotonic() - started_at
+    print(f"{'ok' if ok else 'FAILED':6} {description} ({elapsed * 1000:.0f}ms)")
+    event.clear()
+    return ok
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--processes", type=int, default=1000, help="unrelated processes to run"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=1.5,
+        help="the longest an event may take in seconds",
+    )
+    args = parser.parse_args()
+
+    table = FakeProcessTable(args.processes)
+    scanner = ProcessScanner([Config.WUWA_PROCESS_NAME], table.process_iter)
+    tracker = ProcessTracker(Config.WUWA_PROCESS_NAME, scanner, table.Process)
+    watcher = ProcessWatcher(tracker)
+
+    started, exited = Event(), Event()
+    watcher.on_start(started.set)
+    watcher.on_exit(exited.set)
+    watcher.start()
+
+    results = []
+
+    pid = table.spawn(Config.WUWA_PROCESS_NAME)
+    results.append(expect("start event", started, args.timeout))
+    results.append(expect("no exit event while running", exited, args.timeout, False))
+
+    table.kill(pid)
+    results.append(expect("exit event", exited, args.timeout))
+
+    # Another process reusing the game's PID must not count as the game
+    table.spawn("notepad.exe", pid)
+    results.append(
+        expect("no start event for a reused PID", started, args.timeout, False)
+    )
+
+    pid = table.spawn(Config.WUWA_PROCESS_NAME)
+    results.append(expect("start event after a restart", started, args.timeout))
+
+    table.kill(pid)
+    results.append(expect("exit event after a restart", exited, args.timeout))
+
+    watcher.stop()
+
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
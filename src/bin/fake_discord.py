@@ -0,0 +1,438 @@
+import json
+import os
+import socket
+import struct
+import sys
+from threading import Condition, Event, Lock, Thread
+from time import monotonic, sleep
+
+_HANDSHAKE = 0
+_FRAME = 1
+_CLOSE = 2
+_PING = 3
+_PONG = 4
+_HEADER = "<II"
+
+
+class _SocketClient:
+    """
+    A client connected to the server over a Unix socket
+    """
+
+    def __init__(self, connection: socket.socket) -> None:
+        self.connection = connection
+
+    def recv(self, size: int) -> bytes:
+        return self.connection.recv(size)
+
+    def send(self, data: bytes) -> None:
+        self.connection.sendall(data)
+
+    def close(self) -> None:
+        try:
+            # Wakes up the thread blocked reading from the socket
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+
+class _PipeClient:
+    """
+    A client connected to the server over a Windows named pipe
+    """
+
+    def __init__(self, handle) -> None:
+        self.handle = handle
+        self.closed = False
+
+    def recv(self, size: int) -> bytes:
+        import pywintypes
+        import win32file
+
+        try:
+            _, data = win32file.ReadFile(self.handle, size)
+            return data
+        except pywintypes.error:
+            return b""
+
+    def send(self, data: bytes) -> None:
+        import pywintypes
+        import win32file
+
+        try:
+            win32file.WriteFile(self.handle, data)
+        except pywintypes.error as e:
+            raise OSError(str(e))
+
+    def close(self) -> None:
+        import pywintypes
+        import win32file
+        import win32pipe
+
+        if self.closed:
+            return
+        self.closed = True
+
+        try:
+            win32pipe.DisconnectNamedPipe(self.handle)
+        except pywintypes.error:
+            pass
+        win32file.CloseHandle(self.handle)
+
+
+class FakeDiscordServer(Thread):
+    """
+    A stand-in for the Discord client's RPC server, speaking the same framing
+    over a Unix socket or, on Windows, a named pipe. Every `SET_ACTIVITY` frame
+    it receives is recorded in `activities`. Latency, disconnects and rate limit
+    errors can be injected to exercise the publish path without a real Discord
+    client. pypresence finds the server like it would Discord, so give it a
+    `discord-ipc-N` path in the IPC directory (e.g. `$XDG_RUNTIME_DIR`)
+    """
+
+    path: str
+    latency: float
+    """
+    How many seconds to wait before answering every command
+    """
+    activities: list[dict]
+    """
+    The activity of every `SET_ACTIVITY` frame received, in order. A cleared
+    activity is recorded as None
+    """
+    received_at: list[float]
+    """
+    The monotonic time every entry in `activities` was received at
+    """
+    connections: int
+    """
+    The number of clients that completed the handshake
+    """
+
+    def __init__(self, path: str, latency: float = 0.0) -> None:
+        """
+        Create a new fake Discord server
+
+        :param path: The socket or named pipe path to listen on
+        :param latency: How many seconds to wait before answering every command
+        """
+        super().__init__(daemon=True)
+        self.path = path
+        self.latency = latency
+        self.activities = []
+        self.received_at = []
+        self.connections = 0
+
+        self._clients = set()
+        self._rate_limited = 0
+        self._disconnect_after = None
+        self._lock = Lock()
+        self._received = Condition(self._lock)
+        self._ready_event = Event()
+        self._stop_event = Event()
+
+    @classmethod
+    def ipc_path(cls, directory: str | None = None, pipe: int = 0) -> str:
+        """
+        Get the path the Discord client would listen on
+
+        :param directory: The IPC directory, ignored on Windows
+        :param pipe: The pipe number, 0 to 9
+        :return: The path
+        """
+        if sys.platform == "win32":
+            return rf"\\.\pipe\discord-ipc-{pipe}"
+
+        return os.path.join(directory, f"discord-ipc-{pipe}")
+
+    def wait_until_ready(self, timeout: float | None = None) -> bool:
+        """
+        Block until the server is accepting connections
+
+        :param timeout: The maximum number of seconds to wait, or None to wait forever
+        :return: True if the server is ready, False if the timeout expired
+        """
+        return self._ready_event.wait(timeout)
+
+    def wait_for_activities(self, count: int, timeout: float | None = None) -> bool:
+        """
+        Block until at least `count` activities have been received
+
+        :param count: The number of activities to wait for
+        :param timeout: The maximum number of seconds to wait, or None to wait forever
+        :return: True if enough activities were received, False if the timeout
+        expired
+        """
+        with self._received:
+            return self._received.wait_for(
+                lambda: len(self.activities) >= count, timeout
+            )
+
+    def forget(self) -> None:
+        """
+        Forget the activities received so far, so a long soak doesn't grow
+        `activities` without bound
+        """
+        with self._lock:
+            self.activities.clear()
+            self.received_at.clear()
+
+    def rate_limit(self, count: int = 1) -> None:
+        """
+        Answer the next `count` `SET_ACTIVITY` frames with a rate limit error
+
+        :param count: The number of frames to reject
+        """
+        with self._lock:
+            self._rate_limited += count
+
+    def disconnect(self, after: int = 0) -> None:
+        """
+        Drop every connected client, like Discord does when it quits
+
+        :param after: Drop them after this many more `SET_ACTIVITY` frames
+        instead of straight away
+        """
+        if after > 0:
+            with self._lock:
+                self._disconnect_after = after
+            return
+
+        with self._lock:
+            clients = list(self._clients)
+
+        for client in clients:
+            client.close()
+
+    def stop(self) -> None:
+        """
+        Stop the server and drop every connected client
+        """
+        self._stop_event.set()
+        self.disconnect()
+
+        # Wake the accepting thread up so it notices the server has stopped
+        try:
+            if sys.platform == "win32":
+                with open(self.path, "rb"):
+                    pass
+            else:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                    client.connect(self.path)
+        except OSError:
+            pass
+
+    def run(self) -> None:
+        if sys.platform == "win32":
+            self._serve_pipe()
+        else:
+            self._serve_socket()
+
+    def _serve_socket(self) -> None:
+        """
+        Accept clients on a Unix socket
+        """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(self.path)
+            server.listen()
+            self._ready_event.set()
+
+            try:
+                while not self._stop_event.is_set():
+                    connection, _ = server.accept()
+                    self._accept(_SocketClient(connection))
+            finally:
+                os.unlink(self.path)
+
+    def _serve_pipe(self) -> None:
+        """
+        Accept clients on a Windows named pipe
+        """
+        import win32pipe
+
+        while not self._stop_event.is_set():
+            handle = win32pipe.CreateNamedPipe(
+                self.path,
+                win32pipe.PIPE_ACCESS_DUPLEX,
+                win32pipe.PIPE_TYPE_BYTE
+                | win32pipe.PIPE_READMODE_BYTE
+                | win32pipe.PIPE_WAIT,
+                win32pipe.PIPE_UNLIMITED_INSTANCES,
+                64 * 1024,
+                64 * 1024,
+                0,
+                None,
+            )
+            self._ready_event.set()
+            # Blocks until a client opens the pipe
+            win32pipe.ConnectNamedPipe(handle, None)
+            self._accept(_PipeClient(handle))
+
+    def _accept(self, client) -> None:
+        """
+        Serve a newly connected client on its own thread
+
+        :param client: The client
+        """
+        if self._stop_event.is_set():
+            client.close()
+            return
+
+        with self._lock:
+            self._clients.add(client)
+
+        Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client) -> None:
+        """
+        Answer a client's frames until it disconnects
+
+        :param client: The client
+        """
+        try:
+            # pypresence connects and disconnects straight away to test the path
+            frame = self._read(client)
+            if frame is None or frame[0] != _HANDSHAKE:
+                return
+
+            self._write(
+                client,
+                _FRAME,
+                {
+                    "cmd": "DISPATCH",
+                    "evt": "READY",
+                    "data": {"v": 1, "user": {"id": "0", "username": "fake"}},
+                    "nonce": None,
+                },
+            )
+            with self._lock:
+                self.connections += 1
+
+            while (frame := self._read(client)) is not None:
+                op, payload = frame
+
+                if op == _CLOSE:
+                    break
+                elif op == _PING:
+                    self._write(client, _PONG, payload)
+                elif op == _FRAME:
+                    if not self._command(client, payload):
+                        break
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._clients.discard(client)
+            client.close()
+
+    def _command(self, client, payload: dict) -> bool:
+        """
+        Answer a command frame
+
+        :param client: The client that sent the frame
+        :param payload: The frame's payload
+        :return: True to keep serving the client, False to drop it
+        """
+        if self.latency:
+            sleep(self.latency)
+
+        command = payload.get("cmd")
+        nonce = payload.get("nonce")
+
+        if command != "SET_ACTIVITY":
+            self._write(
+                client,
+                _FRAME,
+                {"cmd": command, "evt": None, "data": {}, "nonce": nonce},
+            )
+            return True
+
+        with self._lock:
+            if self._rate_limited > 0:
+                self._rate_limited -= 1
+                rate_limited = True
+            else:
+                rate_limited = False
+
+        if rate_limited:
+            self._write(
+                client,
+                _FRAME,
+                {
+                    "cmd": command,
+                    "evt": "ERROR",
+                    "data": {"code": 1000, "message": "You are being rate limited"},
+                    "nonce": nonce,
+                },
+            )
+            return True
+
+        activity = payload.get("args", {}).get("activity")
+        with self._received:
+            self.activities.append(activity)
+            self.received_at.append(monotonic())
+            self._received.notify_all()
+
+            if self._disconnect_after is not None:
+                self._disconnect_after -= 1
+                if self._disconnect_after <= 0:
+                    self._disconnect_after = None
+                    return False
+
+        self._write(
+            client,
+            _FRAME,
+            {"cmd": command, "evt": None, "data": activity, "nonce": nonce},
+        )
+        return True
+
+    def _read(self, client) -> tuple[int, dict] | None:
+        """
+        Read a frame from a client
+
+        :param client: The client to read from
+        :return: The frame's opcode and payload, or None if the client
+        disconnected
+        """
+        header = self._read_exactly(client, struct.calcsize(_HEADER))
+        if header is None:
+            return None
+
+        op, length = struct.unpack(_HEADER, header)
+        data = self._read_exactly(client, length)
+        if data is None:
+            return None
+
+        return op, json.loads(data)
+
+    def _read_exactly(self, client, size: int) -> bytes | None:
+        """
+        Read an exact number of bytes from a client
+
+        :param client: The client to read from
+        :param size: The number of bytes to read
+        :return: The bytes, or None if the client disconnected first
+        """
+        data = b""
+        while len(data) < size:
+            chunk = client.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+
+        return data
+
+    def _write(self, client, op: int, payload: dict) -> None:
+        """
+        Send a frame to a client
+
+        :param client: The client to send to
+        :param op: The frame's opcode
+        :param payload: The frame's payload
+        """
+        data = json.dumps(payload).encode("utf-8")
+        client.send(struct.pack(_HEADER, op, len(data)) + data)
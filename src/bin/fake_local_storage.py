@@ -0,0 +1,54 @@
+"""
+Synthetic LocalStorage databases, laid out like the game's, for the database
+benchmarks
+"""
+
+import json
+from sqlite3 import connect
+
+
+def sdk_level_data(uids: int, kuro_games_uid: str, level: int) -> str:
+    """
+    Build a raw `SdkLevelData` value. See `_get_sdk_level_data` for the format
+
+    :param uids: The number of UIDs in the value, including the player's
+    :param kuro_games_uid: The player's UID, which is put last so finding it
+    means going through every other UID
+    :param level: The player's union level
+    :return: The raw value
+    """
+    content = [
+        [str(100000000 + i), [{"Region": "Europe", "Level": i % 80}]]
+        for i in range(uids - 1)
+    ]
+    content.append([kuro_games_uid, [{"Region": "America", "Level": level}]])
+    return json.dumps({"___MetaType___": "___Map___", "Content": content})
+
+
+def create_local_storage(
+    path: str, uids: int, kuro_games_uid: str, level: int = 50
+) -> None:
+    """
+    Create a LocalStorage database file
+
+    :param path: The path of the file to create
+    :param uids: The number of UIDs in its `SdkLevelData`
+    :param kuro_games_uid: The player's UID
+    :param level: The player's union level
+    """
+    connection = connect(path)
+
+    try:
+        connection.execute(
+            "CREATE TABLE LocalStorage (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        connection.executemany(
+            "INSERT INTO LocalStorage VALUES (?, ?)",
+            [
+                ("PatchVersion", '"2.0.0"'),
+                ("SdkLevelData", sdk_level_data(uids, kuro_games_uid, level)),
+            ],
+        )
+        connection.commit()
+    finally:
+        connection.close()
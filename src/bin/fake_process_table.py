@@ -0,0 +1,130 @@
+"""
+A fake psutil process table, so process tracking can be checked and
+benchmarked without starting real processes. Pass `FakeProcessTable.process_iter`
+to `ProcessScanner` and `FakeProcessTable.Process` to `ProcessTracker` in place
+of the psutil functions
+"""
+
+from itertools import count
+from threading import Event, Lock
+from time import time
+
+from psutil import NoSuchProcess, TimeoutExpired
+
+
+class FakeProcess:
+    """
+    A process of a `FakeProcessTable`, with the parts of `psutil.Process` the
+    process tracking uses
+    """
+
+    pid: int
+    info: dict
+
+    def __init__(self, table: "FakeProcessTable", pid: int) -> None:
+        self.table = table
+        self.pid = pid
+        self.info = {}
+
+    def name(self) -> str:
+        return self._entry()[0]
+
+    def create_time(self) -> float:
+        return self._entry()[1]
+
+    def wait(self, timeout: float | None = None) -> None:
+        exited = self._entry()[2]
+        if not exited.wait(timeout):
+            raise TimeoutExpired(timeout, self.pid)
+
+    def _entry(self) -> tuple[str, float, Event]:
+        self.table.lookups += 1
+
+        with self.table.lock:
+            entry = self.table.processes.get(self.pid)
+
+        if entry is None:
+            raise NoSuchProcess(self.pid)
+        return entry
+
+
+class FakeProcessTable:
+    """
+    A process table that processes can be started in and killed from at will
+    """
+
+    processes: dict[int, tuple[str, float, Event]]
+    """
+    The name, create time and exit event of every running process, keyed by PID
+    """
+    lookups: int
+    """
+    The number of process lookups made so far, each of which would be at least
+    one syscall with psutil
+    """
+
+    def __init__(self, size: int = 0) -> None:
+        """
+        Create a new fake process table
+
+        :param size: The number of unrelated processes to fill the table with
+        """
+        self.processes = {}
+        self.lookups = 0
+        self.lock = Lock()
+        self._pids = count(1)
+
+        for i in range(size):
+            self.spawn(f"process-{i}.exe")
+
+    def spawn(self, name: str, pid: int | None = None) -> int:
+        """
+        Start a process
+
+        :param name: The name of the process
+        :param pid: The PID to give it, e.g. to reuse the PID of a process that
+        exited, or None for a new PID
+        :return: The process's PID
+        """
+        pid = pid if pid is not None else next(self._pids)
+        with self.lock:
+            self.processes[pid] = (name, time(), Event())
+        return pid
+
+    def kill(self, pid: int) -> None:
+        """
+        Stop a process
+
+        :param pid: The process's PID
+        """
+        with self.lock:
+            _, _, exited = self.processes.pop(pid)
+        exited.set()
+
+    def process_iter(self, attrs: list[str] | None = None):
+        """
+        Walk the process table, see `psutil.process_iter`
+
+        :param attrs: The attributes to fill `info` with
+        """
+        with self.lock:
+            pids = list(self.processes)
+
+        for pid in pids:
+            process = FakeProcess(self, pid)
+            try:
+                process.info = {attr: getattr(process, attr)() for attr in attrs or []}
+            except NoSuchProcess:
+                continue
+            yield process
+
+    def Process(self, pid: int) -> FakeProcess:
+        """
+        Look a process up by PID, see `psutil.Process`
+
+        :param pid: The process's PID
+        :raises NoSuchProcess: If no process has the PID
+        """
+        process = FakeProcess(self, pid)
+        process.create_time()
+        return process
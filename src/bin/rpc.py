@@ -1,7 +1,8 @@
 import sys
+from argparse import ArgumentParser
 from os.path import exists, join, abspath, dirname, normcase, normpath
 from json import loads
-from src.utilities.rpc import Presence
+from src.utilities.rpc import AsyncPresence, Presence
 
 config_path = join(abspath(dirname(sys.executable)), "config/config.json")
 
@@ -17,5 +18,22 @@ with open(config_path, "r") as f:
             "The rich presence install location in the config file does not match the actual install location. Please update the config file, or setup the RPC again"
         )
 
-presence = Presence(config)
+parser = ArgumentParser()
+parser.add_argument(
+    "--profile",
+    type=int,
+    nargs="?",
+    const=100,
+    metavar="ITERATIONS",
+    help="profile this many iterations of the RPC loop, for at most 10 minutes, and write the results to the logs folder",
+)
+args, _ = parser.parse_known_args()
+if args.profile:
+    config["profile_iterations"] = args.profile
+
+if config.get("engine") == "asyncio":
+    presence = AsyncPresence(config)
+else:
+    presence = Presence(config)
+
 presence.start()
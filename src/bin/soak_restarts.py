@@ -0,0 +1,135 @@
+"""
+Soak test the RPC state machine through thousands of game restarts, checking
+that memory and threads stay flat.
+
+Run with `python -m src.bin.soak_restarts`. The game runs in a fake process
+table and Discord is a fake server, so every restart takes a few
+milliseconds. Only Linux and macOS are supported, as the fake server is found
+through a private `$XDG_RUNTIME_DIR`. Exits with a non-zero status if a
+restart stalls or memory keeps growing
+"""
+
+import os
+import sys
+import threading
+import tracemalloc
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from time import monotonic
+
+from config import Config
+from src.bin.fake_discord import FakeDiscordServer
+from src.bin.fake_process_table import FakeProcessTable
+from src.utilities.rpc import (
+    Presence,
+    ProcessScanner,
+    ProcessTracker,
+    ProcessWatcher,
+    TokenBucket,
+)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--restarts", type=int, default=10000, help="game restarts")
+    parser.add_argument(
+        "--report-every", type=int, default=1000, help="restarts between reports"
+    )
+    parser.add_argument(
+        "--max-growth-kib",
+        type=float,
+        default=256.0,
+        help="the most traced memory may grow after the first report",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=5.0,
+        help="the longest a single restart may take in seconds",
+    )
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+        # Make sure pypresence can only find the fake server
+        os.environ["XDG_RUNTIME_DIR"] = directory
+        server = FakeDiscordServer(FakeDiscordServer.ipc_path(directory, 0))
+        server.start()
+        server.wait_until_ready()
+
+        presence = Presence(
+            {
+                "wuwa_install_location": directory,
+                "using_steam_version": False,
+                "database_access_preference": False,
+                "keep_running_preference": True,
+                "promote_preference": False,
+                "log_level": "WARNING",
+                "log_console": False,
+            }
+        )
+
+        # Follow the game in the fake process table, polling often so every
+        # restart is noticed straight away
+        table = FakeProcessTable(100)
+        presence.process_scanner = ProcessScanner(
+            presence.process_scanner.targets, table.process_iter
+        )
+        presence.process_tracker = ProcessTracker(
+            Config.WUWA_PROCESS_NAME, presence.process_scanner, table.Process
+        )
+        presence.process_watcher = ProcessWatcher(
+            presence.process_tracker, min_poll_interval=0.001, max_poll_interval=0.005
+        )
+        presence.process_watcher.on_exit(presence.refresh_event.set)
+        # Discord's rate limit would make the soak take days
+        presence.scheduler.bucket = TokenBucket(1_000_000_000, 1.0)
+
+        threading.Thread(target=presence.start, daemon=True).start()
+
+        tracemalloc.start()
+        baseline = None
+        failed = False
+        started_at = monotonic()
+
+        print(f"{'restarts':>8} {'elapsed':>9} {'traced':>11} {'threads':>8}")
+
+        for restart in range(1, args.restarts + 1):
+            # Every session publishes its start, then its first update, and
+            # clears the activity once the game has closed
+            server.forget()
+            pid = table.spawn(Config.WUWA_PROCESS_NAME)
+            if not server.wait_for_activities(2, args.timeout):
+                print(f"Restart {restart} stalled waiting for the game to show up")
+                failed = True
+                break
+
+            table.kill(pid)
+            if not server.wait_for_activities(3, args.timeout):
+                print(f"Restart {restart} stalled waiting for the activity to clear")
+                failed = True
+                break
+
+            if restart % args.report_every == 0:
+                traced, _ = tracemalloc.get_traced_memory()
+                if baseline is None:
+                    baseline = traced
+
+                print(
+                    f"{restart:>8} {monotonic() - started_at:>8.1f}s {traced / 1024:>7.1f} KiB {threading.active_count():>8}"
+                )
+
+        tracemalloc.stop()
+        server.stop()
+        server.join()
+
+    if baseline is not None and not failed:
+        growth = (traced - baseline) / 1024
+        print(f"growth:  {growth:+.1f} KiB after the first report")
+        failed = growth > args.max_growth_kib
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,29 @@
 from .assets import DiscordAssets
 from .logger import Logger
+from .callbacks import notify
+from .events import EventLog, Tick, set_outcome, timed
+from .profiler import LoopProfiler
 from .database import (
+    ConnectionManager,
+    DatabaseBusyError,
+    LocalStorageIndex,
+    LocalStorageSnapshot,
+    SdkLevelDataCache,
     get_database,
     get_game_version,
+    get_local_storage_snapshot,
     get_player_region,
     get_player_union_level,
 )
-from .presence import Presence
+from .process import ProcessScanner, ProcessTracker
+from .monitor import ResourceMonitor, ResourceSample
+from .watcher import DirectoryWatcher, ProcessWatcher
+from .connection import (
+    Backoff,
+    DiscordConnection,
+    DiscordDisconnectedError,
+    DiscordSinks,
+)
+from .publisher import Activity, ActivityPublisher, ActivityScheduler, TokenBucket
+from .presence import Presence, RpcState
+from .async_presence import AsyncPresence
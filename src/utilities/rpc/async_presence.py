@@ -0,0 +1,314 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Callable
+
+from pypresence import AioPresence
+
+from config import Config
+from src.utilities.rpc import Activity, Backoff, Presence, set_outcome
+
+
+class AsyncPresence(Presence):
+    """
+    Alternative runtime for `Presence` built on asyncio and
+    `pypresence.AioPresence`. Connecting to Discord, following the game and
+    publishing activities run as concurrent tasks, and database reads are
+    off-loaded to a worker thread, so a slow disk never delays reconnecting to
+    Discord. Selected with `"engine": "asyncio"` in config.json. Database
+    reads and publishes are recorded as separate ticks in the event log. Only
+    a single Discord client is published to, whatever
+    "publish_to_all_discord_clients" is set to
+    """
+
+    presence: AioPresence
+    discord: None
+    """
+    Unused, the connection to Discord is kept open by `discord_task`
+    """
+    backoff: Backoff
+    handshake_timeout: float
+    """
+    The longest to wait for Discord to answer the handshake, as a pipe that
+    accepts connections but never answers would otherwise stall reconnecting
+    """
+    loop: asyncio.AbstractEventLoop
+    connected: asyncio.Event
+    disconnected: asyncio.Event
+    game_running: asyncio.Event
+    refresh: asyncio.Event
+    activity_changed: asyncio.Event
+    executor: ThreadPoolExecutor
+    """
+    Single worker thread for database reads, so connections are never used by
+    two threads at once
+    """
+    pending_activity: Activity | None
+    """
+    The latest activity waiting to be published
+    """
+
+    def __init__(self, config: dict) -> None:
+        super().__init__(config)
+        self.backoff = Backoff()
+        self.handshake_timeout = 5.0
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="AsyncPresence")
+        self.pending_activity = None
+
+    def start(self) -> None:
+        """
+        Start the RPC
+        """
+        try:
+            self.logger.rotate()
+            asyncio.run(self.run())
+        except Exception as e:
+            self.logger.error(f"An uncaught error occured: {e}")
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.resource_monitor.stop()
+            if self.profiler:
+                self.profiler.dump()
+            self.connections.close()
+            self.local_storage_index.close()
+
+    def create_discord(self) -> None:
+        """
+        The connection to Discord is made by `AioPresence` once the event loop
+        is running, so there is no connection supervisor
+
+        :return: None
+        """
+        if self.config.get("publish_to_all_discord_clients"):
+            self.logger.warning(
+                "The asyncio engine only publishes to one Discord client, ignoring publish_to_all_discord_clients"
+            )
+
+    async def run(self) -> None:
+        """
+        Run the RPC until the game closes, or forever if the user wants to keep
+        it running
+        """
+        self.loop = asyncio.get_running_loop()
+        self.presence = AioPresence(Config.APPLICATION_ID, loop=self.loop)
+        self.publisher.presence = self.presence
+
+        self.connected = asyncio.Event()
+        self.disconnected = asyncio.Event()
+        self.game_running = asyncio.Event()
+        self.refresh = asyncio.Event()
+        self.activity_changed = asyncio.Event()
+
+        # The watchers run on their own threads, so hop onto the event loop
+        self.process_watcher.on_start(self._threadsafe(self._on_game_start))
+        self.process_watcher.on_exit(self._threadsafe(self._on_game_exit))
+        if not self.process_watcher.is_alive():
+            self.process_watcher.start()
+        if self.process_watcher.is_running:
+            self.game_running.set()
+
+        if not self.resource_monitor.is_alive():
+            self.resource_monitor.start()
+
+        if self.directory_watcher:
+            self.directory_watcher.callback = self._threadsafe(self.refresh.set)
+            if not self.directory_watcher.is_alive():
+                self.directory_watcher.start()
+
+        tasks = [
+            asyncio.create_task(self.discord_task()),
+            asyncio.create_task(self.publish_task()),
+        ]
+
+        try:
+            await self.game_task()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._disconnect()
+
+    async def discord_task(self) -> None:
+        """
+        Keep the connection to Discord open, reconnecting whenever it breaks
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self.presence.connect(), self.handshake_timeout)
+            except Exception as e:
+                # A timed out handshake leaves the pipe open
+                self._disconnect()
+                delay = self.backoff.next()
+                self.logger.info(
+                    "Discord could not be found installed and running on this machine, retrying..."
+                )
+                self.logger.debug("Retrying in %.1fs: %s", delay, e)
+                await asyncio.sleep(delay)
+                continue
+
+            self.logger.info("Connected to Discord")
+            self.backoff.reset()
+            self.publisher.reset()
+            self.disconnected.clear()
+            self.connected.set()
+            # Resend the current activity on the new connection
+            self.activity_changed.set()
+
+            # Discord closing the pipe only shows up as the reader reaching its
+            # end, so look for it while there is nothing to publish
+            while not self.disconnected.is_set():
+                try:
+                    await asyncio.wait_for(
+                        self.disconnected.wait(), Config.CONNECTION_CHECK_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    if self.presence.sock_reader.at_eof():
+                        self.logger.warning("Discord closed the connection")
+                        self.disconnected.set()
+
+            self.connected.clear()
+            self._disconnect()
+
+    async def game_task(self) -> None:
+        """
+        Follow the game, reading a new activity whenever it changes. If
+        profiling, the database reads are what gets profiled, as the rest of the
+        work happens on the event loop
+        """
+        get_activity = (
+            self.profiler.wrap(self.get_activity)
+            if self.profiler
+            else self.get_activity
+        )
+
+        def read_activity() -> Activity | None:
+            # Ticks belong to the thread they are opened on, so open it on the
+            # worker thread doing the read
+            with self.events.tick():
+                activity = get_activity()
+                if activity is not None:
+                    set_outcome("read")
+                return activity
+
+        while True:
+            if not self.game_running.is_set():
+                self.logger.info("Wuthering Waves is not running, waiting...")
+                await self.game_running.wait()
+
+            self.logger.info("Wuthering Waves is running, starting RPC...")
+            self.start_time = time()
+            self.submit(Activity.create(start=self.start_time))
+
+            while self.game_running.is_set():
+                self.refresh.clear()
+                activity = await self.loop.run_in_executor(self.executor, read_activity)
+                if activity is not None:
+                    self.submit(activity)
+
+                try:
+                    await asyncio.wait_for(self.refresh.wait(), self.update_interval())
+                except asyncio.TimeoutError:
+                    pass
+
+            if not self.config["keep_running_preference"]:
+                self.logger.info("Wuthering Waves has closed, closing RPC...")
+                return
+
+            self.logger.info(
+                "Wuthering waves has closed, waiting for it to start again..."
+            )
+            self.pending_activity = None
+            if self.connected.is_set():
+                try:
+                    await self.presence.clear()
+                    self.publisher.reset()
+                except Exception as e:
+                    self.logger.error(f"Failed to clear the presence: {e}")
+                    self.disconnected.set()
+
+    async def publish_task(self) -> None:
+        """
+        Publish the latest activity whenever it changes, within Discord's rate
+        limit
+        """
+        bucket = self.scheduler.bucket
+
+        while True:
+            await self.activity_changed.wait()
+            self.activity_changed.clear()
+            await self.connected.wait()
+
+            if self.pending_activity is None:
+                continue
+
+            if self.publisher.is_due(self.pending_activity):
+                while not bucket.try_acquire():
+                    await asyncio.sleep(bucket.time_until_available())
+
+            # Anything submitted while waiting replaces the activity we waited for
+            activity = self.pending_activity
+            if activity is None:
+                continue
+
+            try:
+                # Only this task records phases on the event loop thread, so the
+                # tick can stay open while the update is awaited
+                with self.events.tick():
+                    await self.publisher.publish_async(activity)
+                if self.pending_activity == activity:
+                    self.pending_activity = None
+            except Exception as e:
+                self.logger.error(f"Failed to update the presence: {e}")
+                self.disconnected.set()
+
+    def submit(self, activity: Activity) -> None:
+        """
+        Queue an activity for the publish task, replacing any activity that
+        hasn't been published yet
+
+        :param activity: The activity to publish
+        """
+        if self.pending_activity is not None and self.pending_activity != activity:
+            self.scheduler.dropped += 1
+
+        self.pending_activity = activity
+        self.activity_changed.set()
+
+    def _on_game_start(self) -> None:
+        """
+        Handle the game starting
+        """
+        self.game_running.set()
+        self.refresh.set()
+
+    def _on_game_exit(self) -> None:
+        """
+        Handle the game exiting
+        """
+        self.game_running.clear()
+        self.refresh.set()
+
+    def _threadsafe(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Wrap a callback so it can be called from any thread, running it on the
+        event loop
+
+        :param callback: The callback to wrap
+        :return: The wrapped callback
+        """
+        return lambda: self.loop.call_soon_threadsafe(callback)
+
+    def _disconnect(self) -> None:
+        """
+        Close the connection to Discord without closing the event loop, which
+        `AioPresence.close` would do
+        """
+        try:
+            if self.presence.sock_writer is not None:
+                self.presence.send_data(
+                    2, {"v": 1, "client_id": self.presence.client_id}
+                )
+                self.presence.sock_writer.close()
+                self.presence.sock_writer = None
+        except Exception as e:
+            self.logger.error(f"Failed to close the Discord connection: {e}")
@@ -0,0 +1,19 @@
+from typing import Callable
+
+from src.utilities.rpc import Logger
+
+
+def notify(callbacks: list[Callable[[], None]], source: str) -> None:
+    """
+    Call every subscriber, making sure one failing subscriber doesn't stop the
+    others from being notified
+
+    :param callbacks: The subscribers to call
+    :param source: What the subscribers are subscribed to, e.g. "process
+    watcher", for the error logged when one fails
+    """
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            Logger().error("A %s subscriber failed: %s", source, e)
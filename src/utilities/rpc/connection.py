@@ -0,0 +1,530 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
+from random import uniform
+from threading import Lock
+from time import monotonic
+
+from pypresence import PipeClosed, Presence as PyPresence, ResponseTimeout, ServerError
+from pypresence.utils import get_ipc_path
+
+from src.utilities.rpc import Logger
+
+
+class DiscordDisconnectedError(Exception):
+    """
+    Raised when the connection to Discord has been lost
+    """
+
+
+class Backoff:
+    """
+    Jittered exponential backoff. Every delay is picked at random between half
+    and all of `min_delay * 2 ** attempts`, capped at `max_delay`, so several
+    clients don't retry in lockstep
+    """
+
+    min_delay: float
+    max_delay: float
+    attempts: int
+
+    def __init__(self, min_delay: float = 1.0, max_delay: float = 60.0) -> None:
+        """
+        Create a new backoff
+
+        :param min_delay: The delay before the first retry
+        :param max_delay: The longest delay between retries
+        """
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.attempts = 0
+
+    def next(self) -> float:
+        """
+        Get the delay before the next retry
+
+        :return: The delay in seconds
+        """
+        delay = min(self.max_delay, self.min_delay * 2**self.attempts)
+        self.attempts += 1
+        return uniform(delay / 2, delay)
+
+    def reset(self) -> None:
+        """
+        Start again from `min_delay`, after a successful attempt
+        """
+        self.attempts = 0
+
+
+class DiscordConnection:
+    """
+    Supervises the IPC connection to Discord. The connection is kept open across
+    game sessions, with the activity cleared rather than the connection closed
+    when the game exits. A broken pipe is noticed on the first failed call, or
+    by `check` while idle, after which `connected` is False until `connect`
+    succeeds again
+    """
+
+    presence: PyPresence
+    connected: bool
+    backoff: Backoff
+    handshake_timeout: float
+    """
+    The longest to wait for Discord to answer the handshake. pypresence waits
+    forever, so a pipe that accepts connections but never answers would
+    otherwise hang `connect`
+    """
+
+    def __init__(
+        self,
+        presence: PyPresence,
+        backoff: Backoff | None = None,
+        handshake_timeout: float = 5.0,
+    ) -> None:
+        """
+        Create a new connection supervisor
+
+        :param presence: The Discord client to supervise
+        :param backoff: The backoff to use between connection attempts
+        :param handshake_timeout: The longest to wait for Discord to answer the
+        handshake
+        """
+        self.presence = presence
+        self.connected = False
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.handshake_timeout = handshake_timeout
+
+    def connect(self) -> None:
+        """
+        Connect to Discord, if not already connected
+
+        :raises Exception: If Discord could not be connected to
+        """
+        if self.connected:
+            return
+
+        # Same as `pypresence.Presence.connect`, with a deadline
+        self.presence.update_event_loop(asyncio.new_event_loop())
+        try:
+            self.presence.loop.run_until_complete(
+                asyncio.wait_for(self.presence.handshake(), self.handshake_timeout)
+            )
+        except asyncio.TimeoutError as e:
+            self._disconnect()
+            raise DiscordDisconnectedError(
+                "Discord did not answer the handshake in time"
+            ) from e
+
+        self.connected = True
+        self.backoff.reset()
+
+    def update(self, **kwargs) -> dict:
+        """
+        Set the activity, see `pypresence.Presence.update`
+
+        :raises DiscordDisconnectedError: If the connection to Discord is lost
+        """
+        return self._call(self.presence.update, **kwargs)
+
+    def clear(self) -> dict:
+        """
+        Clear the activity without closing the connection
+
+        :raises DiscordDisconnectedError: If the connection to Discord is lost
+        """
+        return self._call(self.presence.clear)
+
+    def check(self) -> bool:
+        """
+        Check whether the connection is still open without sending anything, by
+        letting the client's event loop take in whatever Discord has sent. This
+        includes Discord closing the pipe when it exits or restarts, which
+        would otherwise go unnoticed until the next activity is published
+
+        :return: True if still connected, False if the connection was lost
+        """
+        if not self.connected:
+            return False
+
+        try:
+            self.presence.loop.run_until_complete(asyncio.sleep(0))
+            alive = not (
+                self.presence.sock_reader.at_eof()
+                or self.presence.sock_writer.is_closing()
+            )
+        except (RuntimeError, OSError) as e:
+            Logger().debug("The Discord connection check failed: %s", e)
+            alive = False
+
+        if not alive:
+            self._disconnect()
+
+        return alive
+
+    def close(self) -> None:
+        """
+        Close the connection to Discord
+        """
+        if not self.connected:
+            return
+
+        self.connected = False
+
+        try:
+            self.presence.close()
+        except Exception as e:
+            Logger().error(
+                f"An error occurred while closing the Discord connection: {e}"
+            )
+
+    def _call(self, method, **kwargs) -> dict:
+        """
+        Call a method on the Discord client, tearing the connection down if the
+        pipe turns out to be broken
+
+        :param method: The method to call
+        :raises DiscordDisconnectedError: If the connection to Discord is lost
+        """
+        if not self.connected:
+            raise DiscordDisconnectedError("Not connected to Discord")
+
+        try:
+            return method(**kwargs)
+        except (PipeClosed, ResponseTimeout, OSError, AssertionError) as e:
+            self._disconnect()
+            raise DiscordDisconnectedError(str(e)) from e
+
+    def _disconnect(self) -> None:
+        """
+        Tear down a connection that turned out to be broken
+        """
+        self.connected = False
+
+        try:
+            if self.presence.sock_writer is not None:
+                self.presence.sock_writer.close()
+                # Give the loop a chance to actually close the socket
+                self.presence.loop.run_until_complete(asyncio.sleep(0))
+            self.presence.loop.close()
+        except Exception:
+            pass
+
+
+class _Sink:
+    """
+    One Discord client of a `DiscordSinks`, with its own worker thread. Calls
+    made while the worker is busy replace each other, so a slow client only ever
+    has the latest call waiting for it
+    """
+
+    pipe: int
+    connection: DiscordConnection
+
+    def __init__(self, pipe: int, connection: DiscordConnection) -> None:
+        self.pipe = pipe
+        self.connection = connection
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix=f"discord-ipc-{pipe}")
+        self.busy = False
+        self.pending = None
+        self._lock = Lock()
+
+    def submit(self, method: str, kwargs: dict, queue: bool = True):
+        """
+        Call a method of the connection on the worker thread
+
+        :param method: The name of the method to call
+        :param kwargs: The arguments to call it with
+        :param queue: Whether to queue the call if the worker is busy, rather
+        than dropping it
+        :return: The future of the call, or None if the worker is busy and the
+        call was queued behind it or dropped
+        """
+        with self._lock:
+            if self.busy:
+                if queue:
+                    self.pending = (method, kwargs)
+                return None
+
+            self.busy = True
+
+        return self.executor.submit(self._run, method, kwargs)
+
+    def _run(self, method: str, kwargs: dict):
+        """
+        Make a call, then any call queued while it was running
+        """
+        try:
+            while True:
+                result = getattr(self.connection, method)(**kwargs)
+
+                with self._lock:
+                    if self.pending is None:
+                        self.busy = False
+                        return result
+
+                    method, kwargs = self.pending
+                    self.pending = None
+        except BaseException:
+            with self._lock:
+                self.busy = False
+                self.pending = None
+            raise
+
+
+class DiscordSinks:
+    """
+    Publishes to every running Discord client at once, e.g. Stable alongside
+    PTB or Canary, instead of only the first one pypresence finds. Clients are
+    discovered through their `discord-ipc-0` to `discord-ipc-9` pipes, and each
+    one is driven from its own thread so a slow or broken client never holds
+    the others up. Newly started clients are looked for while checking the
+    connection, never while publishing, and are sent the current activity as
+    soon as they are connected. Has the same interface as `DiscordConnection`
+    """
+
+    client_id: str
+    sinks: dict[int, _Sink]
+    """
+    The connected clients, keyed by pipe number
+    """
+    activity: dict | None
+    """
+    The activity last set, which newly connected clients are sent
+    """
+    backoff: Backoff
+    timeout: float
+    """
+    The longest a call waits for the clients to answer. Slower clients still
+    get the call, just without holding up the caller
+    """
+    discover_interval: float
+    """
+    How often to look for newly started clients while connected
+    """
+    discovering: bool
+    """
+    Whether to look for newly started clients every `discover_interval`
+    seconds. Clients are still looked for straight after one is lost
+    """
+
+    def __init__(
+        self,
+        client_id: str,
+        timeout: float = 1.0,
+        discover_interval: float = 60.0,
+        backoff: Backoff | None = None,
+    ) -> None:
+        """
+        Create a new set of Discord connections
+
+        :param client_id: The Discord application ID
+        :param timeout: The longest a call waits for the clients to answer
+        :param discover_interval: How often to look for newly started clients
+        :param backoff: The backoff to use between connection attempts
+        """
+        self.client_id = client_id
+        self.sinks = {}
+        self.activity = None
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.timeout = timeout
+        self.discover_interval = discover_interval
+        self.discovering = True
+        self.discovered_at = None
+
+    @property
+    def connected(self) -> bool:
+        """
+        Whether at least one Discord client is connected
+        """
+        return any(sink.connection.connected for sink in self.sinks.values())
+
+    @staticmethod
+    def discover() -> list[int]:
+        """
+        Find the pipe of every running Discord client
+
+        :return: The pipe numbers
+        """
+        pipes = []
+
+        for pipe in range(10):
+            try:
+                if get_ipc_path(pipe):
+                    pipes.append(pipe)
+            except OSError as e:
+                # A pipe left behind by a client that crashed refuses connections
+                Logger().debug("Skipping discord-ipc-%d: %s", pipe, e)
+
+        return pipes
+
+    def connect(self) -> None:
+        """
+        Connect to every running Discord client not already connected, all at
+        once. Clients that don't answer the handshake in time are skipped
+
+        :raises Exception: If no Discord client could be connected to
+        """
+        self.discovered_at = monotonic()
+        error = None
+        futures = {}
+
+        for pipe in self.discover():
+            if pipe in self.sinks and self.sinks[pipe].connection.connected:
+                continue
+
+            self._remove(pipe)
+            sink = _Sink(pipe, DiscordConnection(PyPresence(self.client_id, pipe=pipe)))
+            futures[sink.submit("connect", {})] = sink
+
+        # Every handshake has its own deadline, so this never waits for long
+        for future, sink in futures.items():
+            try:
+                future.result()
+                self._add(sink)
+            except Exception as e:
+                Logger().debug(
+                    "Could not connect to the Discord client on discord-ipc-%d: %s",
+                    sink.pipe,
+                    e,
+                )
+                sink.executor.shutdown(wait=False)
+                error = e
+
+        if not self.connected:
+            raise (
+                error
+                if error is not None
+                else DiscordDisconnectedError("No Discord client is running")
+            )
+
+        self.backoff.reset()
+
+    def update(self, **kwargs) -> None:
+        """
+        Set the activity on every connected client
+
+        :raises DiscordDisconnectedError: If every client has disconnected
+        :raises ServerError: If every client that answered refused the activity
+        """
+        self.activity = kwargs
+        self._call("update", kwargs)
+
+    def clear(self) -> None:
+        """
+        Clear the activity on every connected client without disconnecting
+
+        :raises DiscordDisconnectedError: If every client has disconnected
+        :raises ServerError: If every client that answered refused the request
+        """
+        self.activity = None
+        self._call("clear", {})
+
+    def check(self) -> bool:
+        """
+        Check the connection to every idle client without sending anything,
+        dropping the clients that have gone away. Busy clients are skipped, as
+        the call keeping them busy finds out for itself. Newly started clients
+        are looked for every `discover_interval` seconds while `discovering`,
+        and straight away if a client went away, e.g. because it is restarting
+
+        :return: True if at least one client is still connected, False otherwise
+        """
+        futures = {}
+        for pipe, sink in self.sinks.items():
+            future = sink.submit("check", {}, queue=False)
+            if future is not None:
+                futures[future] = pipe
+
+        done, _ = wait(futures, self.timeout)
+        lost = False
+
+        for future in done:
+            pipe = futures[future]
+            if future.exception() is not None or not future.result():
+                Logger().warning("Lost the Discord client on discord-ipc-%s", pipe)
+                self._remove(pipe)
+                lost = True
+
+        if lost or (
+            self.discovering
+            and self.discovered_at is not None
+            and monotonic() - self.discovered_at >= self.discover_interval
+        ):
+            try:
+                self.connect()
+            except Exception as e:
+                Logger().debug("No new Discord client could be connected to: %s", e)
+
+        return self.connected
+
+    def close(self) -> None:
+        """
+        Close the connection to every client
+        """
+        for pipe in list(self.sinks):
+            self._remove(pipe)
+
+    def _call(self, method: str, kwargs: dict) -> None:
+        """
+        Call a method on every connected client at once, dropping the clients
+        that turn out to be disconnected
+
+        :param method: The name of the method to call
+        :param kwargs: The arguments to call it with
+        :raises DiscordDisconnectedError: If every client has disconnected
+        :raises ServerError: If every client that answered refused the call
+        """
+        if not self.connected:
+            raise DiscordDisconnectedError("Not connected to Discord")
+
+        futures = {}
+        for pipe, sink in self.sinks.items():
+            future = sink.submit(method, kwargs)
+            if future is not None:
+                futures[future] = pipe
+
+        done, _ = wait(futures, self.timeout)
+        errors = []
+
+        for future in done:
+            pipe = futures[future]
+            try:
+                future.result()
+            except DiscordDisconnectedError as e:
+                Logger().warning(
+                    "Lost the Discord client on discord-ipc-%s: %s", pipe, e
+                )
+                self._remove(pipe)
+            except ServerError as e:
+                errors.append(e)
+
+        if not self.connected:
+            raise DiscordDisconnectedError("Every Discord client has disconnected")
+
+        if errors and len(errors) == len(done) == len(self.sinks):
+            raise errors[0]
+
+    def _add(self, sink: _Sink) -> None:
+        """
+        Start publishing to a newly connected client, sending it the current
+        activity
+
+        :param sink: The client
+        """
+        self.sinks[sink.pipe] = sink
+        Logger().info("Connected to the Discord client on discord-ipc-%s", sink.pipe)
+
+        if self.activity is not None:
+            sink.submit("update", self.activity)
+
+    def _remove(self, pipe: int) -> None:
+        """
+        Close and forget a client
+
+        :param pipe: The client's pipe number
+        """
+        sink = self.sinks.pop(pipe, None)
+        if sink is None:
+            return
+
+        sink.executor.submit(sink.connection.close)
+        sink.executor.shutdown(wait=False)
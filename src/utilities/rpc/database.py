@@ -1,16 +1,504 @@
-from sqlite3 import Connection, connect
+import os
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from sqlite3 import Connection, OperationalError, connect
 from json import loads
-from src.utilities.rpc import Logger
+from src.utilities.rpc import Logger, timed
 
+READ_ONLY_BUSY_TIMEOUT = 0.1
+"""
+How many seconds a read-only connection waits for the game to release a lock
+before the read is skipped
+"""
 
-def get_database(path: str) -> Connection:
+
+class DatabaseBusyError(Exception):
+    """
+    Raised when a read is skipped because the game holds a lock on the local
+    database
+    """
+
+
+@dataclass(frozen=True)
+class LocalStorageSnapshot:
+    """
+    Everything the presence needs from the local database, read in one query
+    """
+
+    game_version: str = "Unknown"
+    region: str = "Unknown"
+    union_level: str = "Unknown"
+
+
+class SdkLevelDataCache:
+    """
+    Caches parsed `SdkLevelData` values as a Kuro Games UID to level data dict, so
+    looking up a player is O(1) and the JSON is only parsed again when the raw
+    value actually changes. Values are keyed by their length and hash and
+    compared in full on a hit, so a collision can never return stale data
+    """
+
+    max_entries: int
+    entries: OrderedDict[tuple[int, int], tuple[str, dict[str, dict]]]
+    """
+    The raw value and its UID index, keyed by the raw value's length and hash and
+    ordered from least to most recently used
+    """
+
+    def __init__(self, max_entries: int = 8) -> None:
+        """
+        Create a new SdkLevelData cache
+
+        :param max_entries: The maximum number of distinct values to keep parsed
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, raw: str, kuro_games_uid: str) -> dict | None:
+        """
+        Get a player's level data from a raw `SdkLevelData` value
+
+        :param raw: The raw `SdkLevelData` value
+        :param kuro_games_uid: The player's Kuro Games UID
+        :return: The player's level data or None if the Kuro Games UID is not found
+        """
+        key = (len(raw), hash(raw))
+
+        with self._lock:
+            cached = self.entries.get(key)
+            if cached is not None and cached[0] == raw:
+                self.entries.move_to_end(key)
+                return cached[1].get(kuro_games_uid)
+
+        records = self._index(raw)
+
+        with self._lock:
+            self.entries[key] = (raw, records)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return records.get(kuro_games_uid)
+
+    @staticmethod
+    def _index(raw: str) -> dict[str, dict]:
+        """
+        Parse a raw `SdkLevelData` value into a UID to level data dict. See
+        `_get_sdk_level_data` for the format
+
+        :param raw: The raw `SdkLevelData` value
+        :return: The level data of every UID in the value
+        """
+        records = {}
+
+        for entry in loads(raw).get("Content"):
+            # Keep the first entry for a UID, like a linear search would
+            records.setdefault(entry[0], entry[1][0])
+
+        return records
+
+
+_sdk_level_data_cache = SdkLevelDataCache()
+
+_json1_supported: bool | None = None
+"""
+Whether the sqlite library has the JSON1 functions. Detected on first use
+"""
+
+
+class LocalStorageIndex:
+    """
+    Selects the LocalStorage database file belonging to the player, which is the
+    one holding the highest union level for their Kuro Games UID. Every file's
+    score is cached against its `(path, st_mtime_ns, st_size)` stamp, so only
+    files that changed since the last selection are opened and scored again.
+    Files are scored on a small thread pool, concurrently when several need
+    scoring, so a file that hangs can be given up on
+    """
+
+    kuro_games_uid: str
+    read_only: bool
+    max_workers: int
+    score_timeout: float
+    """
+    How many seconds a single file may take to score, counted from when a
+    worker starts on it, before it is skipped
+    """
+    scores: dict[str, tuple[tuple[int, int], int | None]]
+    """
+    The stamp and union level of every scored file, keyed by path. The level is
+    None if it could not be read from the file
+    """
+    skipped_reads: int
+    """
+    The number of times a file couldn't be scored because the game had it locked
+    or scoring it timed out
+    """
+    hung: dict[str, Future]
+    """
+    The scoring of every file that timed out and is still running, keyed by
+    path. These files are skipped until their worker comes back, so a file that
+    hangs holds on to a single thread rather than one per selection
+    """
+
+    def __init__(
+        self,
+        kuro_games_uid: str,
+        read_only: bool = False,
+        max_workers: int = 4,
+        score_timeout: float = 5.0,
+    ) -> None:
+        """
+        Create a new LocalStorage index
+
+        :param kuro_games_uid: The player's Kuro Games UID
+        :param read_only: Whether to open the database files read-only, see `get_database`
+        :param max_workers: The maximum number of files to score at the same time
+        :param score_timeout: How many seconds a single file may take to score
+        """
+        self.kuro_games_uid = kuro_games_uid
+        self.read_only = read_only
+        self.max_workers = max_workers
+        self.score_timeout = score_timeout
+        self.scores = {}
+        self.skipped_reads = 0
+        self.hung = {}
+        self._executor = None
+
+    def select(self, directory: str) -> str | None:
+        """
+        Get the name of the database file with the highest union level in the
+        specified directory
+
+        :param directory: The LocalStorage directory
+        :return: The name of the selected file, the first database file if no union
+        level could be read, or None if there are no database files
+        """
+        logger = Logger()
+        candidates = []
+        stale = {}
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".db"):
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except OSError as e:
+                    logger.error(f"Failed to stat LocalStorage file {entry.name}: {e}")
+                    candidates.append((entry.name, None))
+                    continue
+
+                candidates.append((entry.name, entry.path))
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                cached = self.scores.get(entry.path)
+
+                if cached is None or cached[0] != stamp:
+                    stale[entry.path] = stamp
+
+        if stale:
+            self._score_all(stale)
+
+        # Forget files that no longer exist
+        for path in self.scores.keys() - {path for _, path in candidates}:
+            del self.scores[path]
+
+        highest_union_level = -1
+        selected_file = candidates[0][0] if candidates else None
+
+        for name, path in candidates:
+            cached = self.scores.get(path)
+            union_level = cached[1] if cached is not None else None
+
+            if union_level is not None and union_level > highest_union_level:
+                highest_union_level = union_level
+                selected_file = name
+
+        return selected_file
+
+    def close(self) -> None:
+        """
+        Shut down the scoring thread pool
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _score_all(self, stale: dict[str, tuple[int, int]]) -> None:
+        """
+        Score every stale file and cache the results. A file that is locked or
+        takes longer than `score_timeout` keeps its previous score and is tried
+        again on the next selection, or once its worker comes back if it hung
+
+        :param stale: The stamp of every file to score, keyed by path
+        """
+        logger = Logger()
+
+        for path, future in list(self.hung.items()):
+            if future.done():
+                del self.hung[path]
+            elif path in stale:
+                del stale[path]
+                self._skip(path, "an earlier attempt is still hung on it")
+
+        if not stale:
+            return
+
+        for path in stale:
+            logger.debug("Scoring LocalStorage file: %s", os.path.basename(path))
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max(1, self.max_workers), thread_name_prefix="LocalStorageIndex"
+            )
+
+        started_at = {}
+
+        def score(path: str) -> int | None:
+            started_at[path] = monotonic()
+            return self._score(path)
+
+        futures = {self._executor.submit(score, path): path for path in stale}
+        pending = set(futures)
+
+        while pending:
+            # Files queue up behind each other when there are more than workers,
+            # so each file's timeout only starts once a worker picks it up
+            running = [
+                started_at[futures[future]]
+                for future in pending
+                if futures[future] in started_at
+            ]
+            timeout = (
+                min(running) + self.score_timeout - monotonic()
+                if running
+                else self.score_timeout
+            )
+            done, pending = wait(pending, max(0, timeout), FIRST_COMPLETED)
+
+            for future in done:
+                path = futures[future]
+                try:
+                    self.scores[path] = (stale[path], future.result())
+                except DatabaseBusyError:
+                    self._skip(path, "it is locked by the game")
+
+            for future in list(pending):
+                path = futures[future]
+                if (
+                    path in started_at
+                    and monotonic() - started_at[path] >= self.score_timeout
+                ):
+                    pending.discard(future)
+                    self.hung[path] = future
+                    self._skip(path, "scoring it timed out")
+                    self._abandon_executor()
+
+            # `wait` never returns the files the abandoned pool cancelled
+            for future in list(pending):
+                if future.cancelled():
+                    pending.discard(future)
+                    self._skip(futures[future], "another file timed out")
+
+    def _abandon_executor(self) -> None:
+        """
+        Leave the thread pool to a worker stuck on a file, cancelling the files
+        queued behind it. A new pool is started for the next selection
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _skip(self, path: str, reason: str) -> None:
+        """
+        Record a file that couldn't be scored
+
+        :param path: The path to the file
+        :param reason: Why the file couldn't be scored
+        """
+        self.skipped_reads += 1
+        Logger().warning("Skipped scoring %s, %s", os.path.basename(path), reason)
+
+    def _score(self, path: str) -> int | None:
+        """
+        Read the player's union level from a database file
+
+        :param path: The path to the database file
+        :return: The union level, or None if it could not be read
+        :raises DatabaseBusyError: If the game has the file locked
+        """
+        connection = get_database(path, self.read_only)
+        if connection is None:
+            return None
+
+        try:
+            sdk_level_data = _read_sdk_level_data(connection, self.kuro_games_uid)
+            return int(sdk_level_data["Level"]) if sdk_level_data else None
+        except OperationalError as e:
+            if _is_busy(e):
+                raise DatabaseBusyError(str(e)) from e
+            Logger().error(f"An error occurred while scoring {path}: {e}")
+            return None
+        except Exception as e:
+            Logger().error(f"An error occurred while scoring {path}: {e}")
+            return None
+        finally:
+            connection.close()
+
+
+class ConnectionManager:
+    """
+    Keeps one open connection per LocalStorage database file and hands it out on
+    every tick instead of reconnecting. A connection is only reopened when its
+    file has been replaced, and the least recently used connection is closed
+    once more than `max_connections` files are open
+    """
+
+    max_connections: int
+    read_only: bool
+    connections: OrderedDict[str, tuple[tuple[int, int], Connection]]
+    """
+    The identity of the file each connection was opened on and the connection
+    itself, keyed by path and ordered from least to most recently used
+    """
+    versions: dict[str, tuple[int, int | None, int | None]]
+    """
+    The `PRAGMA data_version` and the database and WAL file modification times
+    last seen by `has_changed`, keyed by path
+    """
+
+    def __init__(self, max_connections: int = 4, read_only: bool = False) -> None:
+        """
+        Create a new connection manager
+
+        :param max_connections: The maximum number of connections to keep open
+        :param read_only: Whether to open the database files read-only, see `get_database`
+        """
+        self.max_connections = max_connections
+        self.read_only = read_only
+        self.connections = OrderedDict()
+        self.versions = {}
+
+    @property
+    def handle_count(self) -> int:
+        """
+        The number of connections currently held open
+        """
+        return len(self.connections)
+
+    def get(self, path: str) -> Connection | None:
+        """
+        Get the connection to a database file, opening it if needed
+
+        :param path: The path to the database file
+        :return: The connection, or None if the file couldn't be opened
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.evict(path)
+            return None
+
+        identity = (stat.st_dev, stat.st_ino)
+        cached = self.connections.get(path)
+
+        if cached is not None:
+            if cached[0] == identity:
+                self.connections.move_to_end(path)
+                return cached[1]
+
+            # The file has been replaced, so the connection points at the old one
+            self.evict(path)
+
+        connection = get_database(path, self.read_only)
+        if connection is None:
+            return None
+
+        self.connections[path] = (identity, connection)
+
+        while len(self.connections) > self.max_connections:
+            self.evict(next(iter(self.connections)))
+
+        return connection
+
+    def has_changed(self, path: str | None) -> bool:
+        """
+        Check whether a database has changed since the last call for the same
+        path. This only reads `PRAGMA data_version` on the open connection, which
+        changes whenever another connection commits, and the modification times
+        of the database and WAL files, so no table data is touched
+
+        :param path: The path to the database file
+        :return: True if the database changed or was never checked, False otherwise
+        """
+        cached = self.connections.get(path)
+        if cached is None:
+            return True
+
+        try:
+            with timed("sqlite"):
+                data_version = cached[1].execute("PRAGMA data_version").fetchone()[0]
+        except Exception:
+            self.versions.pop(path, None)
+            return True
+
+        version = (data_version, _mtime_ns(path), _mtime_ns(f"{path}-wal"))
+        previous = self.versions.get(path)
+        self.versions[path] = version
+        return version != previous
+
+    def evict(self, path: str) -> None:
+        """
+        Close and forget the connection to a database file, if there is one
+
+        :param path: The path to the database file
+        """
+        self.versions.pop(path, None)
+        cached = self.connections.pop(path, None)
+        if cached is None:
+            return
+
+        try:
+            cached[1].close()
+        except Exception as e:
+            Logger().error(f"An error occurred while closing the local database: {e}")
+
+    def close(self) -> None:
+        """
+        Close every open connection
+        """
+        for path in list(self.connections):
+            self.evict(path)
+
+
+def get_database(path: str, read_only: bool = False) -> Connection:
     """
     Get a connection to the local Wuthering Waves database
+
+    :param path: The path to the database file
+    :param read_only: Whether to open the database read-only. A read-only
+    connection never takes a write lock, and only waits `READ_ONLY_BUSY_TIMEOUT`
+    seconds for the game's locks, so reads are skipped instead of stalling
     """
     logger = Logger()
 
     try:
-        return connect(path)
+        # Connections are reused across threads, but never by two threads at once
+        if read_only:
+            return connect(
+                f"{Path(path).resolve().as_uri()}?mode=ro",
+                uri=True,
+                timeout=READ_ONLY_BUSY_TIMEOUT,
+                check_same_thread=False,
+            )
+
+        return connect(path, check_same_thread=False)
     except Exception as e:
         logger.error(f"An error occurred while connecting to the local database: {e}")
 
@@ -72,6 +560,57 @@ def get_game_version(connection: Connection) -> str:
         return "Unknown"
 
 
+def get_local_storage_snapshot(
+    connection: Connection, kuro_games_uid: str
+) -> LocalStorageSnapshot:
+    """
+    Get the game version and the player's region and union level from the local
+    database with a single query, parsing each value at most once
+
+    :param connection: The connection to the local database
+    :param kuro_games_uid: The player's Kuro Games UID
+    :return: The snapshot, with "Unknown" for any value that couldn't be read
+    :raises DatabaseBusyError: If the game has the database locked
+    """
+    logger = Logger()
+
+    try:
+        with timed("sqlite"):
+            cursor = connection.cursor()
+            rows = dict(
+                cursor.execute(
+                    "SELECT key, value FROM LocalStorage WHERE key IN (?, ?)",
+                    ("PatchVersion", "SdkLevelData"),
+                ).fetchall()
+            )
+    except Exception as e:
+        if _is_busy(e):
+            raise DatabaseBusyError(str(e)) from e
+        logger.error(f"An error occurred while fetching the local storage: {e}")
+        return LocalStorageSnapshot()
+
+    game_version = rows.get("PatchVersion") or "Unknown"
+    sdk_level_data = None
+
+    if rows.get("SdkLevelData"):
+        try:
+            with timed("json_parsing"):
+                sdk_level_data = _parse_sdk_level_data(
+                    rows["SdkLevelData"], kuro_games_uid
+                )
+        except Exception as e:
+            logger.error(f"An error occurred while parsing the user's level data: {e}")
+
+    if sdk_level_data is None:
+        return LocalStorageSnapshot(game_version=game_version)
+
+    return LocalStorageSnapshot(
+        game_version=game_version,
+        region=sdk_level_data.get("Region") or "Unknown",
+        union_level=str(sdk_level_data.get("Level") or "Unknown"),
+    )
+
+
 def _get_sdk_level_data(connection: Connection, kuro_games_uid: str) -> dict:
     """
     Get the player's sdk level data from the local database. The level data is
@@ -111,19 +650,115 @@ def _get_sdk_level_data(connection: Connection, kuro_games_uid: str) -> dict:
     logger = Logger()
 
     try:
-        cursor = connection.cursor()
-        result = cursor.execute(
-            "SELECT * FROM LocalStorage WHERE key = ?", ("SdkLevelData",)
-        ).fetchone()
-        value = loads(result[1])
-        content = value.get("Content")
+        return _read_sdk_level_data(connection, kuro_games_uid)
+    except Exception as e:
+        logger.error(f"An error occurred while fetching the user's level data: {e}")
+        return None
+
+
+def _read_sdk_level_data(connection: Connection, kuro_games_uid: str) -> dict | None:
+    """
+    Same as `_get_sdk_level_data`, but errors are raised instead of logged
+
+    :param connection: The connection to the local database
+    :param kuro_games_uid: The player's Kuro Games UID
+    :return: The player's sdk level data or None if the Kuro Games UID is not found
+    """
+    if _has_json1(connection):
+        return _query_sdk_level_data(connection, kuro_games_uid)
+
+    cursor = connection.cursor()
+    result = cursor.execute(
+        "SELECT * FROM LocalStorage WHERE key = ?", ("SdkLevelData",)
+    ).fetchone()
+    return _parse_sdk_level_data(result[1], kuro_games_uid)
+
+
+def _query_sdk_level_data(connection: Connection, kuro_games_uid: str) -> dict | None:
+    """
+    Get the player's sdk level data by searching `SdkLevelData` inside sqlite
+    with JSON1, so only the matching UID's record is returned to Python instead
+    of the whole document. Requires JSON1, see `_has_json1`
 
-        for entry in content:
-            if entry[0] == kuro_games_uid:
-                data = entry[1][0]
-                return data
+    :param connection: The connection to the local database
+    :param kuro_games_uid: The player's Kuro Games UID
+    :return: The player's sdk level data or None if the Kuro Games UID is not found
+    """
+    cursor = connection.cursor()
+    result = cursor.execute(
+        """
+        SELECT json_extract(entry.value, '$[1][0]')
+        FROM LocalStorage, json_each(LocalStorage.value, '$.Content') AS entry
+        WHERE LocalStorage.key = 'SdkLevelData'
+            AND json_extract(entry.value, '$[0]') = ?
+        LIMIT 1
+        """,
+        (kuro_games_uid,),
+    ).fetchone()
 
+    if result is None or result[0] is None:
         return None
-    except Exception as e:
-        logger.error(f"An error occurred while fetching the user's level data: {e}")
+
+    return loads(result[0])
+
+
+def _has_json1(connection: Connection) -> bool:
+    """
+    Check whether the sqlite library supports the JSON1 functions. The result is
+    the same for every connection, so it's only checked once
+
+    :param connection: A connection to use for the check
+    :return: True if JSON1 is available, False otherwise
+    """
+    global _json1_supported
+
+    if _json1_supported is None:
+        try:
+            connection.execute("SELECT value FROM json_each('[]')").fetchall()
+            _json1_supported = True
+        except OperationalError as e:
+            if _is_busy(e):
+                raise
+
+            Logger().warning(
+                "The sqlite library has no JSON1 support, level data will be parsed in Python"
+            )
+            _json1_supported = False
+
+    return _json1_supported
+
+
+def _parse_sdk_level_data(raw: str, kuro_games_uid: str) -> dict | None:
+    """
+    Find the player's sdk level data in the raw `SdkLevelData` value. See
+    `_get_sdk_level_data` for the format. Parsed values are cached, so an
+    unchanged value is not parsed again
+
+    :param raw: The raw `SdkLevelData` value
+    :param kuro_games_uid: The player's Kuro Games UID
+    :return: The player's sdk level data or None if the Kuro Games UID is not found
+    """
+    return _sdk_level_data_cache.get(raw, kuro_games_uid)
+
+
+def _mtime_ns(path: str) -> int | None:
+    """
+    Get the modification time of a file
+
+    :param path: The path to the file
+    :return: The modification time in nanoseconds, or None if the file doesn't exist
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
         return None
+
+
+def _is_busy(error: Exception) -> bool:
+    """
+    Check whether an error was caused by another connection holding a lock
+
+    :param error: The error to check
+    :return: True if the database was busy, False otherwise
+    """
+    return isinstance(error, OperationalError) and "locked" in str(error)
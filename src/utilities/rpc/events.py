@@ -0,0 +1,184 @@
+import json
+import os
+from contextlib import contextmanager
+from threading import Lock, local
+from time import perf_counter, time
+
+from src.utilities.rpc import Logger
+
+_current = local()
+
+
+class Tick:
+    """
+    The timings and outcome of a single presence update
+    """
+
+    started_at: float
+    """
+    When the update started, as a unix timestamp
+    """
+    duration: float | None
+    phases: dict[str, float]
+    """
+    How many seconds were spent in each phase of the update
+    """
+    outcome: str | None
+
+    def __init__(self) -> None:
+        self.started_at = time()
+        self.duration = None
+        self.phases = {}
+        self.outcome = None
+
+    def add(self, phase: str, seconds: float) -> None:
+        """
+        Add time spent in a phase. A phase entered several times adds up
+
+        :param phase: The name of the phase
+        :param seconds: The time spent in it
+        """
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def to_dict(self) -> dict:
+        """
+        Get the tick as a JSON-serializable dict, with times in milliseconds
+
+        :return: The dict
+        """
+        return {
+            "time": round(self.started_at, 3),
+            "duration_ms": (
+                round(self.duration * 1000, 3) if self.duration is not None else None
+            ),
+            "phases_ms": {
+                phase: round(seconds * 1000, 3)
+                for phase, seconds in self.phases.items()
+            },
+            "outcome": self.outcome,
+        }
+
+
+class EventLog:
+    """
+    Optional structured log with one JSON line per presence update, giving the
+    time spent in each phase of the update and its outcome. Phases are timed
+    with `timed` and the outcome is set with `set_outcome`, both of which do
+    nothing outside of a `tick`, so the instrumented code costs next to nothing
+    while the event log is disabled
+    """
+
+    path: str
+    enabled: bool
+    max_bytes: int
+    """
+    The size the event log is rotated at. One rotated file is kept
+    """
+
+    def __init__(
+        self, path: str, enabled: bool = True, max_bytes: int = 1024 * 1024
+    ) -> None:
+        """
+        Create a new event log
+
+        :param path: The path of the JSON lines file to write
+        :param enabled: Whether to record anything at all
+        :param max_bytes: The size the event log is rotated at
+        """
+        self.path = path
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self._file = None
+        # Ticks are written from both the game reads and the publishes, which
+        # run on different threads in the asyncio engine
+        self._lock = Lock()
+
+    @contextmanager
+    def tick(self):
+        """
+        Record a presence update. Phases timed and outcomes set on this thread
+        while the context is open are recorded on the tick, which is written to
+        the event log when the context exits
+
+        :return: The tick, or None if the event log is disabled
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        tick = Tick()
+        _current.tick = tick
+        started = perf_counter()
+
+        try:
+            yield tick
+        except BaseException as e:
+            tick.outcome = f"error: {type(e).__name__}"
+            raise
+        finally:
+            _current.tick = None
+            tick.duration = perf_counter() - started
+            self.write(tick)
+
+    def write(self, tick: Tick) -> None:
+        """
+        Append a tick to the event log
+
+        :param tick: The tick to write
+        """
+        line = json.dumps(tick.to_dict(), separators=(",", ":")) + "\n"
+
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a")
+
+                if self._file.tell() + len(line) > self.max_bytes:
+                    self._file.close()
+                    self._file = None
+                    os.replace(self.path, f"{self.path}.1")
+                    self._file = open(self.path, "a")
+
+                self._file.write(line)
+                self._file.flush()
+            except OSError as e:
+                Logger().error(f"Failed to write to the event log: {e}")
+
+    def close(self) -> None:
+        """
+        Close the event log file
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+@contextmanager
+def timed(phase: str):
+    """
+    Time a phase of the presence update being recorded on this thread, if any
+
+    :param phase: The name of the phase
+    """
+    tick = getattr(_current, "tick", None)
+    if tick is None:
+        yield
+        return
+
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        tick.add(phase, perf_counter() - started)
+
+
+def set_outcome(outcome: str) -> None:
+    """
+    Set the outcome of the presence update being recorded on this thread, if any
+
+    :param outcome: The outcome
+    """
+    tick = getattr(_current, "tick", None)
+    if tick is not None:
+        tick.outcome = outcome
@@ -1,59 +1,469 @@
+import atexit
+import gzip
+import os
+import shutil
 import sys
 from os import makedirs
 from os.path import join, dirname, abspath
 from datetime import datetime
+from queue import Empty, SimpleQueue
+from threading import Event, Lock, Thread
+from time import monotonic
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+_CLEAR = object()
+_ROTATE = object()
+_CLOSE = object()
 
 
 class Logger:
     """
-    Handles application logging
+    Handles application logging. There is one logger per log folder for the
+    whole process, so `Logger()` can be called anywhere without any setup cost.
+    Log calls only queue the record; a background thread keeps the log file open
+    and writes queued records in batches, flushing every `flush_interval`
+    seconds and when the process exits.
+
+    Once the log file grows past `max_bytes` it is rotated to `log.txt.1`
+    (optionally gzipped), keeping `backup_count` old segments. Identical
+    consecutive messages are written once, followed by a "repeated N times"
+    summary.
+
+    Messages below `level` are dropped before anything is done with them.
+    Messages take `%`-style arguments, which are only formatted if the message
+    is kept, so a filtered out message costs a single comparison.
+
+    Once the logger is closed, messages are written straight to the log file
+    on the calling thread, so nothing logged while the process exits is lost
     """
 
     log_file_path: str
+    level: int = LEVELS["INFO"]
+    """
+    The lowest level of message to log
+    """
+    console: bool = sys.stdout is not None
+    """
+    Whether to echo messages to the console. Off by default where there is no
+    console, e.g. in the packaged executable
+    """
+    flush_interval: float = 1.0
+    """
+    The longest a written record can sit in the file buffer before it is flushed
+    """
+    max_bytes: int = 1024 * 1024
+    """
+    The size the log file is rotated at, or 0 to never rotate it
+    """
+    backup_count: int = 3
+    """
+    The number of rotated log files to keep
+    """
+    compress: bool = False
+    """
+    Whether to gzip rotated log files
+    """
+    repeat_summary_interval: float = 600.0
+    """
+    How often to write a "repeated N times" summary while the same message keeps
+    being logged
+    """
+
+    _instances: dict[str, "Logger"] = {}
+    _instances_lock = Lock()
+
+    def __new__(
+        cls,
+        log_folder: str = join(abspath(dirname(sys.executable)), "logs"),
+    ):
+        with cls._instances_lock:
+            instance = cls._instances.get(log_folder)
+            if instance is None:
+                instance = super().__new__(cls)
+                instance._initialized = False
+                cls._instances[log_folder] = instance
+
+            return instance
 
     def __init__(
         self,
         log_folder: str = join(abspath(dirname(sys.executable)), "logs"),
     ):
         """
-        Create a new logger instance
+        Create a new logger instance, or get the existing one for the log folder
 
         :param log_folder: The path to the log folder
         """
-        makedirs(log_folder, exist_ok=True)
-        self.log_folder = log_folder
-        self.log_file_path = join(log_folder, "log.txt")
+        with self._instances_lock:
+            if self._initialized:
+                return
+
+            makedirs(log_folder, exist_ok=True)
+            self.log_folder = log_folder
+            self.log_file_path = join(log_folder, "log.txt")
+            self._queue = SimpleQueue()
+            self._writer = None
+            self._writer_lock = Lock()
+            self._closed = False
+            self._initialized = True
+            atexit.register(self.close)
+
+    def configure(
+        self,
+        level: str | None = None,
+        console: bool | None = None,
+        max_bytes: int | None = None,
+        backup_count: int | None = None,
+        compress: bool | None = None,
+    ):
+        """
+        Change what is logged and how the log file is rotated. Arguments left as
+        None are unchanged
 
-    def error(self, message: str):
+        :param level: The lowest level of message to log: "DEBUG", "INFO",
+        "WARNING" or "ERROR"
+        :param console: Whether to echo messages to the console
+        :param max_bytes: The size the log file is rotated at, or 0 to never
+        rotate it
+        :param backup_count: The number of rotated log files to keep
+        :param compress: Whether to gzip rotated log files
+        """
+        if level is not None:
+            if level.upper() in LEVELS:
+                self.level = LEVELS[level.upper()]
+            else:
+                self.warning("Unknown log level %r, keeping the current level", level)
+        if console is not None:
+            self.console = console
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if backup_count is not None:
+            self.backup_count = backup_count
+        if compress is not None:
+            self.compress = compress
+
+    def error(self, message: str, *args):
         """
         Log an error message
         """
-        self.write("ERROR", message)
-        print(f"ERROR: {message}")
+        self.write("ERROR", message, *args)
 
-    def warning(self, message: str):
+    def warning(self, message: str, *args):
         """
         Log a warning message
         """
-        self.write("WARNING", message)
-        print(f"WARNING: {message}")
+        self.write("WARNING", message, *args)
 
-    def info(self, message: str):
+    def info(self, message: str, *args):
         """
         Log an info message
         """
-        self.write("INFO", message)
-        print(f"INFO: {message}")
+        self.write("INFO", message, *args)
+
+    def debug(self, message: str, *args):
+        """
+        Log a debug message
+        """
+        self.write("DEBUG", message, *args)
+
+    def is_enabled(self, type: str) -> bool:
+        """
+        Check whether messages of a level are logged, to skip building arguments
+        that are expensive to compute
 
-    def write(self, type: str, message: str):
+        :param type: The level
+        :return: True if messages of the level are logged, False otherwise
         """
-        Write a message to the log file
+        return LEVELS[type] >= self.level
+
+    def write(self, type: str, message: str, *args):
+        """
+        Queue a message to be written to the log file, and echo it to the
+        console, if its level is logged
+
+        :param type: The message's level
+        :param message: The message, with `%`-style placeholders for `args`
+        :param args: The arguments to format the message with
         """
-        with open(self.log_file_path, "a") as log_file:
-            log_file.write(f"[{type}] [{datetime.now()}] {message}\n")
+        if LEVELS[type] < self.level:
+            return
+
+        if self.console:
+            print(f"{type}: {_format(message, args)}")
+
+        self._submit((type, datetime.now(), message, args))
+
+    def clear(self):
+        """
+        Clear the log file of all content. Messages queued before the call are
+        cleared too
+        """
+        self._submit(_CLEAR)
+
+    def rotate(self):
+        """
+        Start a new log file, keeping the current one as the newest backup. Does
+        nothing if the current log file is empty
+        """
+        self._submit(_ROTATE)
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Block until every message queued so far has been written to the log file
+
+        :param timeout: The maximum number of seconds to wait, or None to wait forever
+        :return: True if the messages were written, False if the timeout expired
+        """
+        if self._writer is None:
+            return True
+
+        flushed = Event()
+        self._queue.put(flushed)
+        return flushed.wait(timeout)
+
+    def close(self, timeout: float | None = 5.0):
+        """
+        Write every queued message and stop the writer thread. Messages logged
+        afterwards are written straight to the log file. Called automatically
+        when the process exits
+
+        :param timeout: The maximum number of seconds to wait for the writer
+        """
+        with self._writer_lock:
+            writer = self._writer
+            self._writer = None
+            self._closed = True
+
+        if writer is not None:
+            self._queue.put(_CLOSE)
+            writer.join(timeout)
+
+    def _submit(self, record):
+        """
+        Queue a record for the writer thread, starting it if it isn't running
+        yet, or write it straight away if the logger has been closed
+
+        :param record: The record
+        """
+        if self._writer is None:
+            with self._writer_lock:
+                if self._closed:
+                    log_file = _LogFile(self)
+                    try:
+                        self._handle(log_file, record)
+                        log_file.summarize_repeats()
+                    finally:
+                        log_file.close()
+                    return
+
+                if self._writer is None:
+                    self._writer = Thread(target=self._run, name="Logger", daemon=True)
+                    self._writer.start()
+
+        self._queue.put(record)
+
+    def _run(self):
+        """
+        Write queued records to the log file until the logger is closed. Records
+        go through the file buffer, which is flushed at most every
+        `flush_interval` seconds
+        """
+        log_file = _LogFile(self)
+        dirty = False
+        flushed_at = monotonic()
+
+        try:
+            while True:
+                try:
+                    record = self._queue.get(timeout=self.flush_interval)
+                except Empty:
+                    record = None
+
+                if record is _CLOSE:
+                    log_file.summarize_repeats()
+                    return
+                elif record is not None:
+                    self._handle(log_file, record)
+                    dirty = not isinstance(record, Event)
+
+                if (
+                    log_file.repeats
+                    and monotonic() - log_file.summarized_at
+                    >= self.repeat_summary_interval
+                ):
+                    log_file.summarize_repeats()
+                    dirty = True
+
+                if dirty and monotonic() - flushed_at >= self.flush_interval:
+                    log_file.file.flush()
+                    dirty = False
+                    flushed_at = monotonic()
+        finally:
+            log_file.close()
+
+    @staticmethod
+    def _handle(log_file: "_LogFile", record):
+        """
+        Apply a record to the log file
+
+        :param log_file: The log file
+        :param record: A message, or one of the control records
+        """
+        if record is _CLEAR:
+            log_file.clear()
+        elif record is _ROTATE:
+            log_file.summarize_repeats()
+            if log_file.size > 0:
+                log_file.rotate()
+        elif isinstance(record, Event):
+            log_file.summarize_repeats()
+            log_file.file.flush()
+            record.set()
+        else:
+            type, time, message, args = record
+            log_file.record(type, time, _format(message, args))
+
+
+class _LogFile:
+    """
+    The log file as written by one writer, along with which message it is
+    collapsing repeats of. Each writer has its own, so a writer that is still
+    shutting down never touches the file of the next one
+    """
+
+    def __init__(self, logger: Logger):
+        """
+        Open the log file for appending
+
+        :param logger: The logger whose file and rotation settings to use
+        """
+        self.logger = logger
+        self.path = logger.log_file_path
+        self.file = open(self.path, "a")
+        self.size = self.file.tell()
+        # The last message written, how many times it has been repeated since,
+        # and when it was last repeated and last summarized
+        self.last = None
+        self.repeats = 0
+        self.repeated_at = None
+        self.summarized_at = monotonic()
+
+    def record(self, type: str, time: datetime, message: str):
+        """
+        Write a record, or count it if it repeats the last one
+
+        :param type: The record's type
+        :param time: When the record was logged
+        :param message: The record's message
+        """
+        if (type, message) == self.last:
+            if self.repeats == 0:
+                self.summarized_at = monotonic()
+            self.repeats += 1
+            self.repeated_at = time
+            return
+
+        self.summarize_repeats()
+        self.last = (type, message)
+        self.append(f"[{type}] [{time}] {message}\n")
+
+    def summarize_repeats(self):
+        """
+        Write how many times the last message has been repeated since it was last
+        written or summarized
+        """
+        if not self.repeats:
+            return
+
+        type, _ = self.last
+        repeats = self.repeats
+        self.repeats = 0
+        self.summarized_at = monotonic()
+        self.append(
+            f"[{type}] [{self.repeated_at}] Last message repeated {repeats} times\n"
+        )
+
+    def append(self, line: str):
+        """
+        Append a line to the log file, rotating it first if it would grow too big
+
+        :param line: The line to append
+        """
+        max_bytes = self.logger.max_bytes
+        if max_bytes and self.size and self.size + len(line) > max_bytes:
+            self.rotate()
+
+        self.file.write(line)
+        self.size += len(line)
 
     def clear(self):
         """
         Clear the log file of all content
         """
-        open(self.log_file_path, "w").close()
+        self.last = None
+        self.repeats = 0
+        self.file.seek(0)
+        self.file.truncate()
+        self.size = 0
+
+    def rotate(self):
+        """
+        Move the log file to the newest backup, shifting the older backups along
+        and deleting the oldest, then open a new log file
+        """
+        self.file.close()
+        backup_count = self.logger.backup_count
+
+        try:
+            if backup_count > 0:
+                # Backups may or may not be compressed, depending on the setting
+                # at the time they were rotated
+                for extension in ("", ".gz"):
+                    oldest = f"{self.path}.{backup_count}{extension}"
+                    if os.path.exists(oldest):
+                        os.remove(oldest)
+
+                for index in range(backup_count - 1, 0, -1):
+                    for extension in ("", ".gz"):
+                        source = f"{self.path}.{index}{extension}"
+                        if os.path.exists(source):
+                            os.replace(source, f"{self.path}.{index + 1}{extension}")
+
+                if self.logger.compress:
+                    with open(self.path, "rb") as source, gzip.open(
+                        f"{self.path}.1.gz", "wb"
+                    ) as destination:
+                        shutil.copyfileobj(source, destination)
+                    os.remove(self.path)
+                else:
+                    os.replace(self.path, f"{self.path}.1")
+        except OSError as e:
+            print(f"ERROR: Failed to rotate {self.path}: {e}")
+
+        # Truncating also covers a failed rotation, so the log stays bounded
+        self.file = open(self.path, "w")
+        self.size = 0
+
+    def close(self):
+        """
+        Close the log file
+        """
+        self.file.close()
+
+
+def _format(message: str, args: tuple) -> str:
+    """
+    Format a message with its `%`-style arguments, without ever failing
+
+    :param message: The message
+    :param args: The arguments
+    :return: The formatted message
+    """
+    if not args:
+        return message
+
+    try:
+        return message % args
+    except (TypeError, ValueError):
+        return f"{message} {args!r}"
@@ -0,0 +1,210 @@
+from collections import deque
+from dataclasses import dataclass
+from threading import Event, Thread
+from time import monotonic
+from typing import Callable
+
+from psutil import AccessDenied, Process
+
+from src.utilities.rpc import Logger, notify
+
+
+@dataclass(frozen=True)
+class ResourceSample:
+    """
+    The resources used by the process at one point in time
+    """
+
+    taken_at: float
+    """
+    When the sample was taken, on the monotonic clock
+    """
+    cpu_time: float
+    """
+    The total user and system CPU time used so far, in seconds
+    """
+    cpu_percent: float | None
+    """
+    The share of one CPU used since the previous sample, or None for the first
+    sample
+    """
+    rss: int
+    handles: int | None
+    """
+    The number of open handles on Windows, or file descriptors elsewhere
+    """
+    threads: int
+
+
+class ResourceMonitor(Thread):
+    """
+    Samples the CPU time, memory and handles used by this process every
+    `interval` seconds on a background thread, logging the usage and how it
+    has trended over the last `window` samples. Subscribers are notified when
+    usage goes over `cpu_budget` or `rss_budget`, and again once it has dropped
+    comfortably back under both
+    """
+
+    interval: float
+    cpu_budget: float | None
+    """
+    The CPU budget as a percentage of one CPU, or None for no budget
+    """
+    rss_budget: int | None
+    """
+    The memory budget in bytes, or None for no budget
+    """
+    samples: deque[ResourceSample]
+    over_budget: bool
+    over_budget_callbacks: list[Callable[[], None]]
+    within_budget_callbacks: list[Callable[[], None]]
+
+    def __init__(
+        self,
+        interval: float = 300.0,
+        cpu_budget: float | None = None,
+        rss_budget: int | None = None,
+        window: int = 12,
+        recovery: float = 0.8,
+    ) -> None:
+        """
+        Create a new resource monitor
+
+        :param interval: How many seconds to wait between samples
+        :param cpu_budget: The CPU budget as a percentage of one CPU
+        :param rss_budget: The memory budget in bytes
+        :param window: The number of samples to report the trend over
+        :param recovery: The fraction of the budgets usage must drop under
+        before it counts as within budget again, so usage hovering around a
+        budget doesn't flip back and forth
+        """
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.cpu_budget = cpu_budget
+        self.rss_budget = rss_budget
+        self.recovery = recovery
+        self.samples = deque(maxlen=window)
+        self.over_budget = False
+        self.over_budget_callbacks = []
+        self.within_budget_callbacks = []
+        self.logger = Logger()
+
+        self._process = Process()
+        self._stop_event = Event()
+
+    def on_over_budget(self, callback: Callable[[], None]) -> None:
+        """
+        Subscribe to usage going over budget
+
+        :param callback: The function to call when usage goes over budget
+        """
+        self.over_budget_callbacks.append(callback)
+
+    def on_within_budget(self, callback: Callable[[], None]) -> None:
+        """
+        Subscribe to usage dropping back within budget
+
+        :param callback: The function to call when usage is within budget again
+        """
+        self.within_budget_callbacks.append(callback)
+
+    def stop(self) -> None:
+        """
+        Stop monitoring. The monitor thread exits shortly after
+        """
+        self._stop_event.set()
+
+    def run(self) -> None:
+        self.sample()
+
+        while not self._stop_event.wait(self.interval):
+            sample = self.sample()
+            self._report(sample)
+            self._check_budget(sample)
+
+    def sample(self) -> ResourceSample:
+        """
+        Measure the resources used by this process and add them to `samples`
+
+        :return: The sample
+        """
+        with self._process.oneshot():
+            cpu_times = self._process.cpu_times()
+            rss = self._process.memory_info().rss
+            threads = self._process.num_threads()
+
+            try:
+                if hasattr(self._process, "num_handles"):
+                    handles = self._process.num_handles()
+                else:
+                    handles = self._process.num_fds()
+            except AccessDenied:
+                handles = None
+
+        taken_at = monotonic()
+        cpu_time = cpu_times.user + cpu_times.system
+        cpu_percent = None
+
+        if self.samples:
+            previous = self.samples[-1]
+            elapsed = taken_at - previous.taken_at
+            if elapsed > 0:
+                cpu_percent = (cpu_time - previous.cpu_time) / elapsed * 100
+
+        sample = ResourceSample(taken_at, cpu_time, cpu_percent, rss, handles, threads)
+        self.samples.append(sample)
+        return sample
+
+    def _report(self, sample: ResourceSample) -> None:
+        """
+        Log a sample along with the trend since the oldest sample kept
+
+        :param sample: The sample to log
+        """
+        oldest = self.samples[0]
+        minutes = (sample.taken_at - oldest.taken_at) / 60
+        window_cpu = (
+            (sample.cpu_time - oldest.cpu_time) / (minutes * 60) * 100
+            if minutes > 0
+            else 0.0
+        )
+        handles = (
+            f"{sample.handles} handles ({sample.handles - oldest.handles:+d})"
+            if sample.handles is not None and oldest.handles is not None
+            else "unknown handles"
+        )
+
+        self.logger.info(
+            "Resource usage: CPU %.2f%% (%.2f%% over %.0f min), RSS %.1f MiB (%+.1f MiB), %s, %d threads",
+            sample.cpu_percent or 0.0,
+            window_cpu,
+            minutes,
+            sample.rss / 1024 / 1024,
+            (sample.rss - oldest.rss) / 1024 / 1024,
+            handles,
+            sample.threads,
+        )
+
+    def _check_budget(self, sample: ResourceSample) -> None:
+        """
+        Notify subscribers if a sample moved usage over or back within budget
+
+        :param sample: The latest sample
+        """
+        cpu = sample.cpu_percent or 0.0
+
+        if not self.over_budget:
+            if (self.cpu_budget is not None and cpu > self.cpu_budget) or (
+                self.rss_budget is not None and sample.rss > self.rss_budget
+            ):
+                self.over_budget = True
+                self.logger.warning(
+                    "Resource usage is over budget, polling less often and skipping optional work"
+                )
+                notify(self.over_budget_callbacks, "resource monitor")
+        elif (self.cpu_budget is None or cpu <= self.cpu_budget * self.recovery) and (
+            self.rss_budget is None or sample.rss <= self.rss_budget * self.recovery
+        ):
+            self.over_budget = False
+            self.logger.info("Resource usage is back within budget")
+            notify(self.within_budget_callbacks, "resource monitor")
@@ -1,22 +1,51 @@
 import os
-import re
+from enum import Enum
 from sqlite3 import Connection
-from time import sleep, time
+from threading import Event
+from time import monotonic, sleep, time
 
-from psutil import NoSuchProcess, Process, pids
 from pypresence import Presence as PyPresence
 
 from config import Config
 from src.utilities.rpc import (
+    Activity,
+    ActivityPublisher,
+    ActivityScheduler,
+    ConnectionManager,
+    DatabaseBusyError,
+    DirectoryWatcher,
     DiscordAssets,
+    DiscordConnection,
+    DiscordDisconnectedError,
+    DiscordSinks,
+    EventLog,
+    LocalStorageIndex,
+    LocalStorageSnapshot,
     Logger,
-    get_database,
-    get_game_version,
-    get_player_region,
-    get_player_union_level,
+    LoopProfiler,
+    ProcessScanner,
+    ProcessTracker,
+    ProcessWatcher,
+    ResourceMonitor,
+    get_local_storage_snapshot,
+    set_outcome,
+    timed,
 )
 
 
+class RpcState(Enum):
+    """
+    The states of the RPC. The RPC moves through them in order, going back to
+    `WAIT_GAME` after `GAME_CLOSED` if the user wants to keep it running, or to
+    `WAIT_DISCORD` whenever the connection to Discord is lost
+    """
+
+    WAIT_DISCORD = "wait_discord"
+    WAIT_GAME = "wait_game"
+    RUNNING = "running"
+    GAME_CLOSED = "game_closed"
+
+
 class Presence:
     logger: Logger
     local_database: Connection | None
@@ -24,13 +53,98 @@ class Presence:
     Local Wuthering Waves database connection. The database is a sqlite database and 
     is stored inside the Wuthering Waves game folder at 
     "{Game Folder}/Client/Saved/LocalStorage" if using the steam version else 
-    "{Game Folder}/Wuthering Waves Game/Client/Saved/LocalStorage"
+    "{Game Folder}/Wuthering Waves Game/Client/Saved/LocalStorage". None if
+    the database couldn't be opened on the last update, in which case it is
+    opened again on the next one
+    """
+    connections: ConnectionManager
+    """
+    Open connections to the LocalStorage databases, reused across updates
+    """
+    local_storage_index: LocalStorageIndex
+    database_path: str | None
+    last_snapshot: LocalStorageSnapshot | None
+    """
+    The last snapshot read from `database_path`, reused while the database is
+    unchanged
+    """
+    skipped_reads: int
+    """
+    The number of updates skipped because the game had the local database locked
+    """
+    discord: DiscordConnection | DiscordSinks
+    """
+    Supervisor for the connection to Discord, which stays open across game
+    sessions. Unless turned off, every running Discord client is published to
+    """
+    start_time: float | None
+    state: RpcState | None
+    publisher: ActivityPublisher
+    scheduler: ActivityScheduler
+    process_scanner: ProcessScanner
+    """
+    Scanner shared by every process lookup, so the game, its launcher and Discord
+    are all resolved in a single walk of the process table
+    """
+    process_tracker: ProcessTracker
+    process_watcher: ProcessWatcher
+    directory_watcher: DirectoryWatcher | None
+    events: EventLog
+    """
+    Optional JSON lines log of how long each phase of every update takes
+    """
+    profiler: LoopProfiler | None
+    """
+    Profiles the first iterations of the RPC loop, if enabled with
+    "profile_iterations" in config.json or `--profile`
+    """
+    resource_monitor: ResourceMonitor
+    throttled: bool
+    """
+    Whether the RPC is polling less often and skipping optional work because
+    it went over its resource budget
+    """
+    refresh_event: Event
+    """
+    Set to wake the RPC loop up for an update before its interval has passed
     """
-    presence: PyPresence
 
     def __init__(self, config: dict) -> None:
         self.config = config
         self.logger = Logger()
+        self.logger.configure(
+            level=self.config.get("log_level"),
+            console=self.config.get("log_console"),
+            max_bytes=self.config.get("log_max_bytes"),
+            backup_count=self.config.get("log_backup_count"),
+            compress=self.config.get("log_compress"),
+        )
+        self.process_scanner = ProcessScanner(
+            [
+                Config.WUWA_PROCESS_NAME,
+                Config.WUWA_CLIENT_PROCESS_NAME,
+                Config.WUWA_LAUNCHER_PROCESS_NAME,
+                *Config.DISCORD_PROCESS_NAMES,
+            ]
+        )
+        self.process_tracker = ProcessTracker(
+            Config.WUWA_PROCESS_NAME, self.process_scanner
+        )
+        self.process_watcher = ProcessWatcher(self.process_tracker)
+        self.refresh_event = Event()
+        self.process_watcher.on_exit(self.refresh_event.set)
+        self.events = EventLog(
+            os.path.join(self.logger.log_folder, "events.jsonl"),
+            self.config.get("event_log", False),
+        )
+        if self.config.get("profile_iterations"):
+            self.profiler = LoopProfiler(
+                self.logger.log_folder, self.config["profile_iterations"]
+            )
+            # Only profile the work, not the wait for the next update
+            self.update_once = self.profiler.wrap(self.update_once)
+        else:
+            self.profiler = None
 
         self.database_directory = os.path.join(
             self.config["wuwa_install_location"],
@@ -39,110 +153,309 @@ class Presence:
             else "Wuthering Waves Game/Client/Saved/LocalStorage",
         )
 
+        # Open the game's database read-only by default so we never contend with
+        # the game for its write lock
+        read_only = self.config.get("database_read_only", True)
+        self.connections = ConnectionManager(read_only=read_only)
+        self.local_storage_index = LocalStorageIndex(
+            self.config.get("kuro_games_uid"), read_only
+        )
+        self.database_path = None
+        self.last_snapshot = None
+        self.skipped_reads = 0
+
+        # Refresh the presence as soon as the game writes to its database
+        if self.config["database_access_preference"] and os.path.isdir(
+            self.database_directory
+        ):
+            self.directory_watcher = DirectoryWatcher(
+                self.database_directory, self.refresh_event.set
+            )
+        else:
+            self.directory_watcher = None
+
         # If the user wants to access the database, get the database connection
         if self.config["database_access_preference"]:
             local_storage = self.get_lastest_database_file(self.database_directory)
             self.logger.info(f"Found last modified LocalStorage file: {local_storage}")
             if local_storage:
-                database_path = os.path.join(self.database_directory, local_storage)
-                self.local_database = get_database(database_path)
+                self.database_path = os.path.join(
+                    self.database_directory, local_storage
+                )
+                self.local_database = self.connections.get(self.database_path)
             else:
                 self.local_database = None
         else:
             self.local_database = None
 
-        self.presence = PyPresence(Config.APPLICATION_ID)
+        self.discord = self.create_discord()
+        self.publisher = ActivityPublisher(
+            self.discord, self.config.get("presence_keep_alive_interval")
+        )
+        self.scheduler = ActivityScheduler(self.publisher)
+        self.start_time = None
+        self.state = None
+
+        # Back off when the RPC uses more than its share of the machine
+        rss_budget = self.config.get("resource_rss_budget_mb", 200)
+        self.resource_monitor = ResourceMonitor(
+            self.config.get("resource_monitor_interval", 300),
+            self.config.get("resource_cpu_budget", 5.0),
+            rss_budget * 1024 * 1024 if rss_budget is not None else None,
+        )
+        self.resource_monitor.on_over_budget(lambda: self.throttle(True))
+        self.resource_monitor.on_within_budget(lambda: self.throttle(False))
+        self.throttled = False
+
+    def create_discord(self) -> DiscordConnection | DiscordSinks:
+        """
+        Create the supervisor for the connection to Discord, which publishes to
+        every running Discord client unless turned off
+
+        :return: The supervisor
+        """
+        if self.config.get("publish_to_all_discord_clients", True):
+            return DiscordSinks(Config.APPLICATION_ID)
+
+        return DiscordConnection(PyPresence(Config.APPLICATION_ID))
 
     def get_lastest_database_file(self, directory: str):
         """
-        Returns the name of the lastest database file with a '.db' extension
-        in the specified directory.
+        Returns the name of the database file with a '.db' extension in the
+        specified directory that holds the player's highest union level. Files
+        that haven't changed since the last call are not opened again
 
         :param directory: The directory to search for the lastest file
         :return: The name of the lastest file, or None if no matching file is found
         """
-        pattern = re.compile(r".*\.db$")
-        highest_union_level = -1
-        latest_file = None
+        self.logger.debug("Looking for the lastest LocalStorage file in %s", directory)
+        return self.local_storage_index.select(directory)
 
-        self.logger.info(f"Looking for the lastest LocalStorage file in {directory}")
-        for file in os.listdir(directory):
-            if latest_file is None:
-                latest_file = file
+    def start(self) -> None:
+        """
+        Start the RPC. This runs the state machine until the game closes, or
+        forever if the user wants to keep it running
+        """
+        try:
+            self.logger.rotate()
+
+            if not self.process_watcher.is_alive():
+                self.process_watcher.start()
+
+            if self.directory_watcher and not self.directory_watcher.is_alive():
+                self.directory_watcher.start()
+
+            if not self.resource_monitor.is_alive():
+                self.resource_monitor.start()
+
+            handlers = {
+                RpcState.WAIT_DISCORD: self.wait_for_discord,
+                RpcState.WAIT_GAME: self.wait_for_game,
+                RpcState.RUNNING: self.rpc_loop,
+                RpcState.GAME_CLOSED: self.game_closed,
+            }
+            self.state = RpcState.WAIT_DISCORD
+            while self.state is not None:
+                self.state = handlers[self.state]()
+        except Exception as e:
+            self.logger.error(f"An uncaught error occured: {e}")
+        finally:
+            # Write whatever was profiled if the RPC stopped early
+            if self.profiler:
+                self.profiler.dump()
 
-            if pattern.match(file):
-                self.logger.info(f"Found LocalStorage file: {file}")
+    def wait_for_discord(self) -> RpcState:
+        """
+        Try to connect to Discord
 
-                connection = get_database(os.path.join(directory, file))
-                union_level = get_player_union_level(
-                    connection, self.config["kuro_games_uid"]
+        :return: The next state
+        """
+        try:
+            self.discord.connect()
+            self.publisher.reset()
+            return RpcState.WAIT_GAME
+        except Exception as e:
+            delay = self.discord.backoff.next()
+            # Keep the repeating message the same every time so the log collapses it
+            if self.discord_process_exists():
+                self.logger.info(
+                    "Discord is running but its RPC connection could not be established, retrying..."
                 )
+            else:
+                self.logger.info(
+                    "Discord could not be found installed and running on this machine, retrying..."
+                )
+            self.logger.debug("Retrying in %.1fs: %s", delay, e)
+            sleep(delay)
+            return RpcState.WAIT_DISCORD
+
+    def wait_for_game(self) -> RpcState:
+        """
+        Wait for Wuthering Waves to start
 
-                if union_level == "Unknown":
-                    continue
+        :return: The next state
+        """
+        if not self.process_watcher.wait_for_start(timeout=1):
+            self.logger.info("Wuthering Waves is not running, waiting...")
+            self.process_watcher.wait_for_start()
 
-                if int(union_level) > highest_union_level:
-                    highest_union_level = int(union_level)
-                    latest_file = file
+        self.logger.info("Wuthering Waves and Discord are running, starting RPC...")
+        # Keep the start time if we only reconnected to Discord mid-session
+        if self.start_time is None:
+            self.start_time = time()
 
-                connection.close()
+        try:
+            self.scheduler.submit(Activity.create(start=self.start_time))
+        except DiscordDisconnectedError as e:
+            self.logger.warning(f"Lost the connection to Discord: {e}")
+            return RpcState.WAIT_DISCORD
 
-        return latest_file
+        return RpcState.RUNNING
 
-    def start(self) -> None:
+    def update_once(self) -> bool:
         """
-        Start the RPC
+        Update the RPC if the game is still running
+
+        :return: Whether the game is still running
         """
-        try:
-            self.logger.clear()
+        with self.events.tick():
+            if not self.wuwa_process_exists():
+                set_outcome("game_closed")
+                return False
 
-            while True:
-                try:
-                    self.presence.connect()
+            self.update()
+            return True
+
+    def rpc_loop(self) -> RpcState:
+        """
+        Update the RPC once and wait for the next update
+
+        :return: The next state
+        """
+        self.refresh_event.clear()
+
+        try:
+            if not self.update_once():
+                return RpcState.GAME_CLOSED
+
+            # Wait for the next update, sending any rate limited update on the way
+            # and making sure Discord is still there while nothing is published
+            deadline = monotonic() + self.update_interval()
+            while not self.refresh_event.is_set():
+                remaining = deadline - monotonic()
+                if remaining <= 0:
                     break
-                except Exception as e:
-                    self.logger.info(
-                        f"Discord could not be found installed and running on this machine"
-                    )
-                    sleep(15)
 
-            while not self.wuwa_process_exists():
-                self.logger.info("Wuthering Waves is not running, waiting...")
-                sleep(15)
+                remaining = min(remaining, Config.CONNECTION_CHECK_INTERVAL)
+                next_flush = self.scheduler.next_flush_in()
+                if next_flush is not None:
+                    remaining = min(remaining, next_flush)
 
-            self.logger.info("Wuthering Waves and Discord are running, starting RPC...")
-            self.start_time = time()
-            self.presence.update(start=self.start_time)
-            self.rpc_loop()
-        except Exception as e:
-            self.logger.error(f"An uncaught error occured: {e}")
+                self.refresh_event.wait(timeout=remaining)
+                self.scheduler.flush()
 
-    def rpc_loop(self) -> None:
+                if not self.discord.check():
+                    raise DiscordDisconnectedError("Discord closed the connection")
+        except DiscordDisconnectedError as e:
+            self.logger.warning(f"Lost the connection to Discord: {e}")
+            return RpcState.WAIT_DISCORD
+
+        return RpcState.RUNNING
+
+    def game_closed(self) -> RpcState | None:
         """
-        Loop to keep the RPC running
+        Clean up after Wuthering Waves has closed
+
+        :return: The next state, or None to stop the RPC
         """
-        # Loop while Wuthering Waves process is running
-        while self.wuwa_process_exists():
-            self.update()
-            sleep(15)
+        self.start_time = None
+        self.scheduler.pending = None
 
         if self.config["keep_running_preference"]:
-            self.presence.close()
-            while not self.wuwa_process_exists():
-                self.logger.info(
-                    "Wuthering waves has closed, waiting for it to start again..."
-                )
-                sleep(30)
-            self.start()
+            # Keep the connection open so the next session shows up straight away
+            try:
+                self.discord.clear()
+                self.publisher.reset()
+            except DiscordDisconnectedError as e:
+                self.logger.warning(f"Lost the connection to Discord: {e}")
 
+            self.logger.info(
+                "Wuthering waves has closed, waiting for it to start again..."
+            )
+            self.process_watcher.wait_for_start()
+            return (
+                RpcState.WAIT_GAME if self.discord.connected else RpcState.WAIT_DISCORD
+            )
+
+        self.discord.close()
         self.logger.info("Wuthering Waves has closed, closing RPC...")
-        self.presence.close()
+        self.events.close()
+        self.resource_monitor.stop()
+        self.connections.close()
+        self.local_storage_index.close()
+        return None
+
+    def update_interval(self) -> float:
+        """
+        Get the longest time to wait between updates. Updates are triggered early
+        when the game exits or writes to its database, so if file change
+        notifications are available the interval only serves as a keep-alive
+
+        :return: The interval in seconds
+        """
+        if self.directory_watcher and self.directory_watcher.is_native:
+            interval = Config.NOTIFIED_UPDATE_INTERVAL
+        else:
+            interval = Config.UPDATE_INTERVAL
+
+        if self.throttled:
+            interval *= Config.THROTTLED_INTERVAL_MULTIPLIER
+
+        return interval
+
+    def throttle(self, throttled: bool) -> None:
+        """
+        Poll less often and skip optional work, i.e. the event log, presence
+        keep-alives and looking for new Discord clients, or go back to normal
+
+        :param throttled: True to throttle the RPC, False to go back to normal
+        """
+        if throttled == self.throttled:
+            return
+
+        self.throttled = throttled
+        scale = (
+            Config.THROTTLED_INTERVAL_MULTIPLIER
+            if throttled
+            else 1 / Config.THROTTLED_INTERVAL_MULTIPLIER
+        )
+
+        self.process_watcher.max_poll_interval *= scale
+        if self.directory_watcher:
+            self.directory_watcher.poll_interval *= scale
+        if isinstance(self.discord, DiscordSinks):
+            self.discord.discovering = not throttled
+
+        self.events.enabled = not throttled and self.config.get("event_log", False)
+        self.publisher.keep_alive_interval = (
+            None if throttled else self.config.get("presence_keep_alive_interval")
+        )
 
     def update(self) -> None:
         """
         Update RPC presence
         """
-        self.logger.info("Updating RPC presence...")
+        activity = self.get_activity()
+        if activity is not None:
+            self.scheduler.submit(activity)
+
+    def get_activity(self) -> Activity | None:
+        """
+        Build the activity to show from the game's current state
+
+        :return: The activity, or None if this update should be skipped
+        """
+        self.logger.debug("Updating RPC presence...")
 
         # Add a button to the RPC to promote the Rich Presence if the user wants to
         buttons = (
@@ -157,51 +470,85 @@ class Presence:
         )
 
         # Update the RPC with only basic information if the user doesn't want to access the database
-        if self.local_database is None:
-            self.presence.update(
-                start=self.start_time,
-                details="Exploring SOL-III",
-                large_image=DiscordAssets.LARGE_IMAGE,
-                large_text="Wuthering Waves",
-                buttons=buttons,
-            )
-            return
+        if not self.config["database_access_preference"]:
+            return self.get_basic_activity(buttons)
 
         try:
             # Check for the lastest database file
-            local_storage = self.get_lastest_database_file(self.database_directory)
-            self.logger.info(f"Found last modified LocalStorage file: {local_storage}")
+            with timed("database_selection"):
+                local_storage = self.get_lastest_database_file(self.database_directory)
+            self.logger.debug(
+                "Found last modified LocalStorage file: %s", local_storage
+            )
 
             if local_storage:
                 database_path = os.path.join(self.database_directory, local_storage)
-                try:
-                    self.local_database = get_database(database_path)
-                except self.local_database.Error as e:
-                    self.logger.error(f"Failed to connect to database: {e}")
-                    self.local_database = None
-
-            region = get_player_region(
-                self.local_database, self.config["kuro_games_uid"]
-            )
-            union_level = get_player_union_level(
-                self.local_database, self.config["kuro_games_uid"]
+                self.local_database = self.connections.get(database_path)
+
+                if database_path != self.database_path:
+                    self.database_path = database_path
+                    self.last_snapshot = None
+
+            # The file can be missing for a moment, e.g. while the game replaces
+            # it, so only show basic information until it can be opened again
+            if self.local_database is None:
+                self.logger.warning(
+                    "The local database could not be opened, showing basic information"
+                )
+                return self.get_basic_activity(buttons)
+
+            # Only read the database if the game has written to it since the last update
+            if (
+                self.connections.has_changed(self.database_path)
+                or self.last_snapshot is None
+            ):
+                self.last_snapshot = get_local_storage_snapshot(
+                    self.local_database, self.config["kuro_games_uid"]
+                )
+            else:
+                self.logger.debug(
+                    "The local database hasn't changed, reusing last data"
+                )
+
+            snapshot = self.last_snapshot
+        except DatabaseBusyError:
+            # Make sure the database is read on the next update
+            self.last_snapshot = None
+            self.skipped_reads += 1
+            set_outcome("database_busy")
+            self.logger.warning(
+                "The local database is locked by the game, skipping this update (%d skipped so far)",
+                self.skipped_reads,
             )
-            game_version = get_game_version(self.local_database)
-        except self.local_database.Error as e:
+            return None
+        except Connection.Error as e:
             self.logger.error(f"Failed to retrieve game data: {e}")
-            region = "Unknown"
-            union_level = "Unknown"
-            game_version = "Unknown"
+            snapshot = LocalStorageSnapshot()
 
-        self.presence.update(
+        return Activity.create(
             start=self.start_time,
-            details=f"Union Level {union_level}",
-            state=f"Region: {region}",
+            details=f"Union Level {snapshot.union_level}",
+            state=f"Region: {snapshot.region}",
             large_image=DiscordAssets.LARGE_IMAGE,
             large_text="Wuthering Waves",
             small_image=DiscordAssets.SMALL_IMAGE,
             # For some reason quotes are automatically added around the game version, and i don't want that
-            small_text=f"Version: {game_version}".replace('"', ""),
+            small_text=f"Version: {snapshot.game_version}".replace('"', ""),
+            buttons=buttons,
+        )
+
+    def get_basic_activity(self, buttons: list[dict] | None) -> Activity:
+        """
+        Build an activity that doesn't need the local database
+
+        :param buttons: The buttons to show
+        :return: The activity
+        """
+        return Activity.create(
+            start=self.start_time,
+            details="Exploring SOL-III",
+            large_image=DiscordAssets.LARGE_IMAGE,
+            large_text="Wuthering Waves",
             buttons=buttons,
         )
 
@@ -211,11 +558,13 @@ class Presence:
 
         :return: True if the process is running, False otherwise
         """
-        for pid in pids():
-            try:
-                if Process(pid).name() == Config.WUWA_PROCESS_NAME:
-                    return True
-            except NoSuchProcess:
-                pass
+        return self.process_watcher.is_running
+
+    def discord_process_exists(self) -> bool:
+        """
+        Check whether any Discord client (Stable, PTB or Canary) is running. A
+        recent scan of the process table is reused if there is one
 
-        return False
+        :return: True if a Discord client is running, False otherwise
+        """
+        return self.process_scanner.any_running(Config.DISCORD_PROCESS_NAMES, 1)
@@ -0,0 +1,184 @@
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable, Iterable, Iterator
+
+import psutil
+from psutil import AccessDenied, NoSuchProcess, TimeoutExpired
+
+
+class ProcessScanner:
+    """
+    Resolves a set of process names to PIDs in a single pass over the process
+    table, so that looking for several processes (e.g. the game and Discord)
+    costs one walk instead of one per process
+    """
+
+    targets: frozenset[str]
+    index: dict[str, int]
+    """
+    The PID of every target found during the last scan, keyed by process name
+    """
+    create_times: dict[str, float]
+    scanned_at: float | None
+    process_iter: Callable[..., Iterator[psutil.Process]]
+
+    def __init__(
+        self,
+        targets: Iterable[str],
+        process_iter: Callable[..., Iterator[psutil.Process]] = psutil.process_iter,
+    ) -> None:
+        """
+        Create a new process scanner
+
+        :param targets: The names of the processes to look for
+        :param process_iter: The function to walk the process table with, see
+        `psutil.process_iter`
+        """
+        self.targets = frozenset(targets)
+        self.process_iter = process_iter
+        self.index = {}
+        self.create_times = {}
+        self.scanned_at = None
+        self._lock = Lock()
+
+    def scan(self, max_age: float = 0) -> dict[str, int]:
+        """
+        Walk the process table once and index every target that is running
+
+        :param max_age: Reuse the previous scan if it is at most this many seconds old
+        :return: The PID of every running target, keyed by process name
+        """
+        with self._lock:
+            if self.scanned_at is not None and monotonic() - self.scanned_at <= max_age:
+                return dict(self.index)
+
+            index = {}
+            create_times = {}
+
+            for process in self.process_iter(["name", "create_time"]):
+                name = process.info["name"]
+                if name in self.targets and name not in index:
+                    index[name] = process.pid
+                    create_times[name] = process.info["create_time"]
+
+                    if len(index) == len(self.targets):
+                        break
+
+            self.index = index
+            self.create_times = create_times
+            self.scanned_at = monotonic()
+            return dict(index)
+
+    def any_running(self, names: Iterable[str], max_age: float = 0) -> bool:
+        """
+        Check whether any of the given targets is running
+
+        :param names: The target names to check
+        :param max_age: Reuse the previous scan if it is at most this many seconds old
+        :return: True if at least one of the targets is running, False otherwise
+        """
+        index = self.scan(max_age)
+        return any(name in index for name in names)
+
+
+class ProcessTracker:
+    """
+    Tracks a single process by name. The process table is only scanned until the
+    process is found, after which its PID and create time are pinned and only
+    that PID is checked. A full scan is done again once the pinned process has
+    exited or its PID has been reused by another process
+    """
+
+    process_name: str
+    scanner: ProcessScanner
+    pid: int | None
+    create_time: float | None
+    process: Callable[[int], psutil.Process]
+
+    def __init__(
+        self,
+        process_name: str,
+        scanner: ProcessScanner | None = None,
+        process: Callable[[int], psutil.Process] = psutil.Process,
+    ) -> None:
+        """
+        Create a new process tracker
+
+        :param process_name: The name of the process to track
+        :param scanner: The scanner to use for full scans. Sharing a scanner lets
+        one walk of the process table serve several lookups
+        :param process: The function to look a process up by PID with, see
+        `psutil.Process`. It should see the same process table as the scanner
+        """
+        self.process_name = process_name
+        self.scanner = (
+            scanner if scanner is not None else ProcessScanner([process_name])
+        )
+        self.process = process
+        self.pid = None
+        self.create_time = None
+
+    def is_running(self) -> bool:
+        """
+        Check whether the tracked process is running
+
+        :return: True if the process is running, False otherwise
+        """
+        if self.pid is not None and self._pinned_process_is_running():
+            return True
+
+        return self.scan()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Block until the pinned process exits or the timeout expires. This uses a
+        waitable process handle where the platform supports it
+
+        :param timeout: The maximum number of seconds to wait
+        :return: True if the pinned process has exited (or none is pinned), False
+        if it is still running after the timeout
+        """
+        if self.pid is None:
+            return True
+
+        try:
+            process = self.process(self.pid)
+            if process.create_time() != self.create_time:
+                return True
+            process.wait(timeout)
+            return True
+        except TimeoutExpired:
+            return False
+        except NoSuchProcess:
+            return True
+        except AccessDenied:
+            # We can't wait on the handle, so fall back to polling the pinned PID
+            sleep(timeout)
+            return not self._pinned_process_is_running()
+
+    def scan(self) -> bool:
+        """
+        Scan the whole process table for the tracked process and pin it if found
+
+        :return: True if the process was found, False otherwise
+        """
+        index = self.scanner.scan()
+        self.pid = index.get(self.process_name)
+        self.create_time = self.scanner.create_times.get(self.process_name)
+        return self.pid is not None
+
+    def _pinned_process_is_running(self) -> bool:
+        """
+        Check whether the pinned PID still belongs to the tracked process. A
+        different create time means the PID has been reused
+
+        :return: True if the pinned process is still running, False otherwise
+        """
+        try:
+            process = self.process(self.pid)
+            return (
+                process.create_time() == self.create_time
+                and process.name() == self.process_name
+            )
+        except (NoSuchProcess, AccessDenied):
+            return False
@@ -0,0 +1,184 @@
+import os
+import tracemalloc
+from cProfile import Profile
+from datetime import datetime
+from functools import wraps
+from io import StringIO
+from pstats import Stats
+from time import monotonic
+from typing import Callable
+
+from src.utilities.rpc import Logger
+
+
+class LoopProfiler:
+    """
+    Profiles the first `iterations` calls of a function, typically the work
+    done in one iteration of the RPC loop, with cProfile, taking a tracemalloc
+    snapshot every `snapshot_interval` calls. The stats and the top allocation
+    sites are then written to the log folder, so users can send them in when
+    the RPC uses more CPU or memory than it should. Profiling stops early after
+    `max_duration` seconds, as iterations can be minutes apart
+    """
+
+    folder: str
+    iterations: int
+    snapshot_interval: int
+    max_duration: float
+    """
+    The most seconds to profile for, counted from the first call
+    """
+    top: int
+    """
+    The number of functions and allocation sites to include in the report
+    """
+    count: int
+    """
+    The number of calls profiled so far
+    """
+    done: bool
+
+    def __init__(
+        self,
+        folder: str,
+        iterations: int = 100,
+        snapshot_interval: int = 10,
+        max_duration: float = 600.0,
+        top: int = 30,
+    ) -> None:
+        """
+        Create a new loop profiler
+
+        :param folder: The folder to write the results to
+        :param iterations: The number of calls to profile
+        :param snapshot_interval: How many calls to take a memory snapshot after
+        :param max_duration: The most seconds to profile for
+        :param top: The number of functions and allocation sites to report
+        """
+        self.folder = folder
+        self.iterations = iterations
+        self.snapshot_interval = snapshot_interval
+        self.max_duration = max_duration
+        self.top = top
+        self.count = 0
+        self.done = False
+
+        self._profile = Profile()
+        self._snapshots = []
+        self._started_at = None
+
+    def wrap(self, function: Callable) -> Callable:
+        """
+        Wrap a function so its first `iterations` calls, or the calls in the
+        first `max_duration` seconds, are profiled
+
+        :param function: The function to profile
+        :return: The wrapped function
+        """
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if self.done:
+                return function(*args, **kwargs)
+
+            if self.count == 0:
+                Logger().info(
+                    "Profiling the next %d iterations, for at most %.0fs...",
+                    self.iterations,
+                    self.max_duration,
+                )
+                tracemalloc.start()
+                self._snapshots.append(tracemalloc.take_snapshot())
+                self._started_at = monotonic()
+
+            self._profile.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._profile.disable()
+                self.count += 1
+
+                if self.count % self.snapshot_interval == 0:
+                    self._snapshots.append(tracemalloc.take_snapshot())
+                if (
+                    self.count >= self.iterations
+                    or monotonic() - self._started_at >= self.max_duration
+                ):
+                    self.dump()
+
+        return wrapper
+
+    def dump(self) -> None:
+        """
+        Write the results and stop profiling. Does nothing if nothing was
+        profiled or the results were already written
+        """
+        if self.done or self.count == 0:
+            return
+
+        self.done = True
+        if tracemalloc.is_tracing():
+            self._snapshots.append(tracemalloc.take_snapshot())
+            tracemalloc.stop()
+
+        name = f"profile-{datetime.now():%Y%m%d-%H%M%S}"
+        stats_path = os.path.join(self.folder, f"{name}.prof")
+        report_path = os.path.join(self.folder, f"{name}.txt")
+
+        try:
+            self._profile.dump_stats(stats_path)
+
+            with open(report_path, "w") as report:
+                report.write(f"Profiled iterations: {self.count}\n")
+                report.write(f"Profiled for: {monotonic() - self._started_at:.0f}s\n\n")
+                report.write(self._cpu_report())
+                report.write(self._memory_report())
+
+            Logger().info(f"Wrote the profiling results to {report_path}")
+        except OSError as e:
+            Logger().error(f"Failed to write the profiling results: {e}")
+
+        self._profile = None
+        self._snapshots = []
+
+    def _cpu_report(self) -> str:
+        """
+        Format the functions that took the most time
+
+        :return: The report
+        """
+        output = StringIO()
+        stats = Stats(self._profile, stream=output)
+        stats.sort_stats("cumulative").print_stats(self.top)
+        stats.sort_stats("tottime").print_stats(self.top)
+        return output.getvalue()
+
+    def _memory_report(self) -> str:
+        """
+        Format the largest allocation sites at the end of profiling, and the
+        sites that grew the most while profiling
+
+        :return: The report
+        """
+        # Leave out the memory used by tracemalloc's own bookkeeping
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+        self._snapshots = [
+            snapshot.filter_traces(filters) for snapshot in self._snapshots
+        ]
+        first, last = self._snapshots[0], self._snapshots[-1]
+        lines = [f"Top {self.top} allocation sites:"]
+        lines += [str(stat) for stat in last.statistics("lineno")[: self.top]]
+
+        lines += ["", f"Top {self.top} allocation sites by growth:"]
+        lines += [str(stat) for stat in last.compare_to(first, "lineno")[: self.top]]
+
+        lines += ["", "Traced memory per snapshot:"]
+        lines += [
+            f"{index}: {sum(stat.size for stat in snapshot.statistics('filename')) / 1024:.1f} KiB"
+            for index, snapshot in enumerate(self._snapshots)
+        ]
+
+        return "\n".join(lines) + "\n"
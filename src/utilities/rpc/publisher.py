@@ -0,0 +1,377 @@
+from dataclasses import dataclass
+from time import monotonic
+
+from pypresence import AioPresence, Presence as PyPresence, ServerError
+
+from src.utilities.rpc import (
+    DiscordConnection,
+    DiscordSinks,
+    Logger,
+    set_outcome,
+    timed,
+)
+
+
+@dataclass(frozen=True)
+class Activity:
+    """
+    A normalized, hashable Discord activity. Two activities that would produce
+    the same payload compare equal
+    """
+
+    start: int | None = None
+    details: str | None = None
+    state: str | None = None
+    large_image: str | None = None
+    large_text: str | None = None
+    small_image: str | None = None
+    small_text: str | None = None
+    buttons: tuple[tuple[str, str], ...] | None = None
+    """
+    The label and url of every button
+    """
+
+    @classmethod
+    def create(
+        cls, start: float | None = None, buttons: list[dict] | None = None, **fields
+    ) -> "Activity":
+        """
+        Create an activity from the same arguments `pypresence.Presence.update`
+        takes
+
+        :param start: The activity start time as a unix timestamp
+        :param buttons: The buttons as a list of `{"label": ..., "url": ...}` dicts
+        :param fields: The remaining activity fields
+        :return: The activity
+        """
+        return cls(
+            start=int(start) if start is not None else None,
+            buttons=(
+                tuple((button["label"], button["url"]) for button in buttons)
+                if buttons
+                else None
+            ),
+            **fields,
+        )
+
+    def to_kwargs(self) -> dict:
+        """
+        Get the activity as keyword arguments for `pypresence.Presence.update`
+
+        :return: The keyword arguments, without any unset fields
+        """
+        kwargs = {
+            "start": self.start,
+            "details": self.details,
+            "state": self.state,
+            "large_image": self.large_image,
+            "large_text": self.large_text,
+            "small_image": self.small_image,
+            "small_text": self.small_text,
+            "buttons": (
+                [{"label": label, "url": url} for label, url in self.buttons]
+                if self.buttons
+                else None
+            ),
+        }
+
+        return {key: value for key, value in kwargs.items() if value is not None}
+
+
+class ActivityPublisher:
+    """
+    Sends activities to Discord, skipping any activity that is the same as the
+    one last sent. An unchanged activity is still resent once
+    `keep_alive_interval` seconds have passed, if one is set
+    """
+
+    presence: DiscordConnection | DiscordSinks | PyPresence | AioPresence
+    keep_alive_interval: float | None
+    last_activity: Activity | None
+    last_sent_at: float | None
+    sent: int
+    """
+    The number of activities sent to Discord
+    """
+    suppressed: int
+    """
+    The number of activities skipped because nothing changed
+    """
+    rejected: int
+    """
+    The number of activities Discord answered with an error
+    """
+
+    def __init__(
+        self,
+        presence: DiscordConnection | DiscordSinks | PyPresence | AioPresence,
+        keep_alive_interval: float | None = None,
+    ) -> None:
+        """
+        Create a new activity publisher
+
+        :param presence: The Discord connection to publish to
+        :param keep_alive_interval: How many seconds to wait before resending an
+        unchanged activity, or None to never resend it
+        """
+        self.presence = presence
+        self.keep_alive_interval = keep_alive_interval
+        self.last_activity = None
+        self.last_sent_at = None
+        self.sent = 0
+        self.suppressed = 0
+        self.rejected = 0
+
+    def publish(self, activity: Activity) -> bool:
+        """
+        Send an activity to Discord if it differs from the last one sent
+
+        :param activity: The activity to send
+        :return: True if the activity was sent, False if it was skipped or
+        rejected
+        """
+        if not self.is_due(activity):
+            self._suppress()
+            return False
+
+        try:
+            with timed("ipc_publish"):
+                self.presence.update(**activity.to_kwargs())
+        except ServerError as e:
+            self._rejected(e)
+            return False
+
+        self._sent(activity)
+        return True
+
+    async def publish_async(self, activity: Activity) -> bool:
+        """
+        Same as `publish`, for when `presence` is a `pypresence.AioPresence`
+
+        :param activity: The activity to send
+        :return: True if the activity was sent, False if it was skipped or
+        rejected
+        """
+        if not self.is_due(activity):
+            self._suppress()
+            return False
+
+        try:
+            with timed("ipc_publish"):
+                await self.presence.update(**activity.to_kwargs())
+        except ServerError as e:
+            self._rejected(e)
+            return False
+
+        self._sent(activity)
+        return True
+
+    def is_due(self, activity: Activity) -> bool:
+        """
+        Check whether publishing an activity would actually send it to Discord
+
+        :param activity: The activity to check
+        :return: True if the activity differs from the last one sent or a
+        keep-alive is due, False otherwise
+        """
+        return activity != self.last_activity or self._keep_alive_due()
+
+    def reset(self) -> None:
+        """
+        Forget the last activity sent, so the next one is always sent. This should
+        be called whenever the Discord connection is re-established
+        """
+        self.last_activity = None
+        self.last_sent_at = None
+
+    def _suppress(self) -> None:
+        """
+        Record an activity that was skipped because nothing changed
+        """
+        self.suppressed += 1
+        set_outcome("suppressed")
+        Logger().debug(
+            "Presence unchanged, skipping update (%d sent, %d skipped)",
+            self.sent,
+            self.suppressed,
+        )
+
+    def _rejected(self, error: ServerError) -> None:
+        """
+        Record an activity that Discord refused, e.g. because of its rate limit.
+        The activity isn't remembered as sent, so the next update retries it
+
+        :param error: The error Discord answered with
+        """
+        self.rejected += 1
+        set_outcome("rejected")
+        Logger().warning("Discord rejected the presence update: %s", error)
+
+    def _sent(self, activity: Activity) -> None:
+        """
+        Record an activity that was sent to Discord
+
+        :param activity: The activity that was sent
+        """
+        self.last_activity = activity
+        self.last_sent_at = monotonic()
+        self.sent += 1
+        set_outcome("published")
+
+    def _keep_alive_due(self) -> bool:
+        """
+        Check whether an unchanged activity should be resent
+
+        :return: True if the keep-alive interval has passed, False otherwise
+        """
+        return (
+            self.keep_alive_interval is not None
+            and self.last_sent_at is not None
+            and monotonic() - self.last_sent_at >= self.keep_alive_interval
+        )
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter allowing bursts of up to `capacity` actions and
+    `capacity` actions per `period` seconds on average
+    """
+
+    capacity: int
+    period: float
+    tokens: float
+    updated_at: float
+
+    def __init__(self, capacity: int, period: float) -> None:
+        """
+        Create a new, full token bucket
+
+        :param capacity: The maximum number of tokens
+        :param period: How many seconds it takes to refill an empty bucket
+        """
+        self.capacity = capacity
+        self.period = period
+        self.tokens = capacity
+        self.updated_at = monotonic()
+
+    def try_acquire(self) -> bool:
+        """
+        Take a token if one is available
+
+        :return: True if a token was taken, False otherwise
+        """
+        self._refill()
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+    def time_until_available(self) -> float:
+        """
+        Get how long it is until a token is available
+
+        :return: The time in seconds, 0 if a token is available now
+        """
+        self._refill()
+        return max(0, (1 - self.tokens) * self.period / self.capacity)
+
+    def _refill(self) -> None:
+        """
+        Add the tokens accumulated since the last refill
+        """
+        now = monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated_at) * self.capacity / self.period,
+        )
+        self.updated_at = now
+
+
+class ActivityScheduler:
+    """
+    Sits in front of an `ActivityPublisher` and keeps activity updates within
+    Discord's rate limit of 5 updates per 20 seconds. Activities submitted while
+    the limit is reached wait in a queue that only ever holds the latest
+    activity, since older ones would be overwritten on Discord anyway. Call
+    `flush` once `next_flush_in` has passed to send it
+    """
+
+    publisher: ActivityPublisher
+    bucket: TokenBucket
+    pending: Activity | None
+    dropped: int
+    """
+    The number of activities replaced by a newer one before they could be sent
+    """
+
+    def __init__(
+        self, publisher: ActivityPublisher, capacity: int = 5, period: float = 20.0
+    ) -> None:
+        """
+        Create a new activity scheduler
+
+        :param publisher: The publisher to send activities with
+        :param capacity: The number of updates Discord allows per `period`
+        :param period: The rate limit window in seconds
+        """
+        self.publisher = publisher
+        self.bucket = TokenBucket(capacity, period)
+        self.pending = None
+        self.dropped = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        The number of activities waiting to be sent
+        """
+        return 0 if self.pending is None else 1
+
+    def submit(self, activity: Activity) -> None:
+        """
+        Queue an activity and send it straight away if the rate limit allows
+
+        :param activity: The activity to send
+        """
+        if self.pending is not None and self.pending != activity:
+            self.dropped += 1
+
+        self.pending = activity
+        self.flush()
+
+    def flush(self) -> bool:
+        """
+        Send the queued activity if the rate limit allows. Activities that
+        wouldn't change anything are handed to the publisher without using up
+        the rate limit
+
+        :return: True if the queue is now empty, False if the activity is still
+        waiting
+        """
+        if self.pending is None:
+            return True
+
+        if self.publisher.is_due(self.pending) and not self.bucket.try_acquire():
+            set_outcome("rate_limited")
+            Logger().debug(
+                "Rate limited, delaying presence update by %.1fs",
+                self.bucket.time_until_available(),
+            )
+            return False
+
+        activity = self.pending
+        self.pending = None
+        self.publisher.publish(activity)
+        return True
+
+    def next_flush_in(self) -> float | None:
+        """
+        Get how long it is until the queued activity can be sent
+
+        :return: The time in seconds, or None if nothing is queued
+        """
+        if self.pending is None:
+            return None
+
+        return self.bucket.time_until_available()
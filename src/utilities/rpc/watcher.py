@@ -0,0 +1,381 @@
+import os
+import sys
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from select import select
+from struct import calcsize, unpack_from
+from threading import Event, Thread
+from time import monotonic
+from typing import Callable
+
+from src.utilities.rpc import Logger, ProcessTracker, notify
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT_HEADER = "iIII"
+
+
+class ProcessWatcher(Thread):
+    """
+    Watches a tracked process on a background thread and notifies subscribers
+    when it starts and exits. While the process is running the watcher blocks on
+    the process itself, so an exit is noticed almost immediately. While it isn't,
+    the process table is polled at an interval that grows from
+    `min_poll_interval` to `max_poll_interval`, so with the defaults the process
+    starting is noticed within a second. The RPC multiplies `max_poll_interval`
+    by `Config.THROTTLED_INTERVAL_MULTIPLIER` while throttled
+    """
+
+    tracker: ProcessTracker
+    start_callbacks: list[Callable[[], None]]
+    exit_callbacks: list[Callable[[], None]]
+
+    def __init__(
+        self,
+        tracker: ProcessTracker,
+        min_poll_interval: float = 0.5,
+        max_poll_interval: float = 1.0,
+    ) -> None:
+        """
+        Create a new process watcher
+
+        :param tracker: The tracker for the process to watch
+        :param min_poll_interval: The shortest interval between process table scans
+        :param max_poll_interval: The longest interval between process table scans
+        """
+        super().__init__(daemon=True)
+        self.tracker = tracker
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.start_callbacks = []
+        self.exit_callbacks = []
+        self.logger = Logger()
+
+        self._stop_event = Event()
+        self._started_event = Event()
+        self._exited_event = Event()
+        self._exited_event.set()
+
+    @property
+    def is_running(self) -> bool:
+        """
+        Whether the watched process was running when it was last checked
+        """
+        return self._started_event.is_set()
+
+    def on_start(self, callback: Callable[[], None]) -> None:
+        """
+        Subscribe to the watched process starting
+
+        :param callback: The function to call when the process starts
+        """
+        self.start_callbacks.append(callback)
+
+    def on_exit(self, callback: Callable[[], None]) -> None:
+        """
+        Subscribe to the watched process exiting
+
+        :param callback: The function to call when the process exits
+        """
+        self.exit_callbacks.append(callback)
+
+    def wait_for_start(self, timeout: float | None = None) -> bool:
+        """
+        Block until the watched process is running
+
+        :param timeout: The maximum number of seconds to wait, or None to wait forever
+        :return: True if the process is running, False if the timeout expired
+        """
+        return self._started_event.wait(timeout)
+
+    def wait_for_exit(self, timeout: float | None = None) -> bool:
+        """
+        Block until the watched process is not running
+
+        :param timeout: The maximum number of seconds to wait, or None to wait forever
+        :return: True if the process is not running, False if the timeout expired
+        """
+        return self._exited_event.wait(timeout)
+
+    def stop(self) -> None:
+        """
+        Stop watching the process. The watcher thread exits shortly after
+        """
+        self._stop_event.set()
+
+    def run(self) -> None:
+        poll_interval = self.min_poll_interval
+
+        while not self._stop_event.is_set():
+            if not self.tracker.is_running():
+                self._stop_event.wait(poll_interval)
+                poll_interval = min(poll_interval * 2, self.max_poll_interval)
+                continue
+
+            self._exited_event.clear()
+            self._started_event.set()
+            notify(self.start_callbacks, "process watcher")
+
+            while not self._stop_event.is_set():
+                if self.tracker.wait(self.min_poll_interval):
+                    break
+
+            if self._stop_event.is_set():
+                break
+
+            self._started_event.clear()
+            self._exited_event.set()
+            notify(self.exit_callbacks, "process watcher")
+            poll_interval = self.min_poll_interval
+
+
+class DirectoryWatcher(Thread):
+    """
+    Watches a directory on a background thread and calls `callback` when a file
+    with one of the watched suffixes changes. Change notifications come from
+    inotify on Linux and ReadDirectoryChangesW on Windows, with a fallback that
+    polls file stamps where neither is available. Bursts of writes are debounced
+    into a single callback
+    """
+
+    directory: str
+    callback: Callable[[], None]
+    suffixes: tuple[str, ...]
+    backend: str
+    """
+    The notification backend in use: "inotify", "windows" or "polling"
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        callback: Callable[[], None],
+        suffixes: tuple[str, ...] = (".db", ".db-wal"),
+        debounce: float = 0.5,
+        max_delay: float = 2.0,
+        poll_interval: float = 2.0,
+    ) -> None:
+        """
+        Create a new directory watcher
+
+        :param directory: The directory to watch
+        :param callback: The function to call when a watched file changes
+        :param suffixes: The suffixes of the files to watch
+        :param debounce: How many quiet seconds to wait for after a change before
+        calling `callback`
+        :param max_delay: The longest a change can be held back by debouncing
+        :param poll_interval: The interval between scans when polling
+        """
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.callback = callback
+        self.suffixes = suffixes
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.logger = Logger()
+
+        if sys.platform == "linux":
+            self.backend = "inotify"
+        elif sys.platform == "win32":
+            self.backend = "windows"
+        else:
+            self.backend = "polling"
+
+        self._stop_event = Event()
+        self._change_event = Event()
+
+    @property
+    def is_native(self) -> bool:
+        """
+        Whether changes are pushed by the operating system rather than polled
+        """
+        return self.backend != "polling"
+
+    def stop(self) -> None:
+        """
+        Stop watching the directory. The watcher thread exits shortly after
+        """
+        self._stop_event.set()
+        self._change_event.set()
+
+    def run(self) -> None:
+        Thread(target=self._watch, daemon=True).start()
+
+        while not self._stop_event.is_set():
+            self._change_event.wait()
+            first_change = monotonic()
+
+            # Wait for the burst of writes to settle down
+            while not self._stop_event.is_set():
+                self._change_event.clear()
+                quiet = not self._change_event.wait(self.debounce)
+                if quiet or monotonic() - first_change >= self.max_delay:
+                    break
+
+            if self._stop_event.is_set():
+                break
+
+            notify([self.callback], "directory watcher")
+
+    def _watch(self) -> None:
+        """
+        Feed changes into the debouncer using the best available backend
+        """
+        try:
+            if self.backend == "inotify":
+                self._watch_inotify()
+            elif self.backend == "windows":
+                self._watch_windows()
+        except Exception as e:
+            self.logger.warning(
+                f"File change notifications are unavailable, falling back to polling: {e}"
+            )
+
+        if not self._stop_event.is_set():
+            self.backend = "polling"
+            self._watch_polling()
+
+    def _changed(self, name: str) -> None:
+        """
+        Record a change to a file in the directory
+
+        :param name: The name of the file that changed
+        """
+        if name.endswith(self.suffixes):
+            self._change_event.set()
+
+    def _watch_inotify(self) -> None:
+        """
+        Watch the directory with inotify
+        """
+        libc = CDLL(find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(get_errno(), "inotify_init1 failed")
+
+        try:
+            mask = (
+                _IN_MODIFY
+                | _IN_CLOSE_WRITE
+                | _IN_CREATE
+                | _IN_DELETE
+                | _IN_MOVED_FROM
+                | _IN_MOVED_TO
+            )
+            if libc.inotify_add_watch(fd, os.fsencode(self.directory), mask) < 0:
+                raise OSError(get_errno(), "inotify_add_watch failed")
+
+            header_size = calcsize(_INOTIFY_EVENT_HEADER)
+
+            while not self._stop_event.is_set():
+                readable, _, _ = select([fd], [], [], 1.0)
+                if not readable:
+                    continue
+
+                try:
+                    buffer = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+
+                offset = 0
+                while offset < len(buffer):
+                    _, event_mask, _, length = unpack_from(
+                        _INOTIFY_EVENT_HEADER, buffer, offset
+                    )
+                    name = buffer[offset + header_size : offset + header_size + length]
+                    offset += header_size + length
+
+                    if event_mask & _IN_Q_OVERFLOW:
+                        # Events were dropped, so assume something changed
+                        self._change_event.set()
+                    else:
+                        self._changed(os.fsdecode(name.rstrip(b"\0")))
+        finally:
+            os.close(fd)
+
+    def _watch_windows(self) -> None:
+        """
+        Watch the directory with ReadDirectoryChangesW
+        """
+        import win32con
+        import win32file
+
+        handle = win32file.CreateFile(
+            self.directory,
+            win32con.GENERIC_READ,
+            win32con.FILE_SHARE_READ
+            | win32con.FILE_SHARE_WRITE
+            | win32con.FILE_SHARE_DELETE,
+            None,
+            win32con.OPEN_EXISTING,
+            win32con.FILE_FLAG_BACKUP_SEMANTICS,
+            None,
+        )
+
+        try:
+            while not self._stop_event.is_set():
+                # Blocks until something in the directory changes
+                changes = win32file.ReadDirectoryChangesW(
+                    handle,
+                    64 * 1024,
+                    False,
+                    win32con.FILE_NOTIFY_CHANGE_FILE_NAME
+                    | win32con.FILE_NOTIFY_CHANGE_SIZE
+                    | win32con.FILE_NOTIFY_CHANGE_LAST_WRITE,
+                    None,
+                    None,
+                )
+
+                if not changes:
+                    # The notification buffer overflowed
+                    self._change_event.set()
+
+                for _, name in changes:
+                    self._changed(name)
+        finally:
+            handle.Close()
+
+    def _watch_polling(self) -> None:
+        """
+        Watch the directory by comparing file stamps at a fixed interval
+        """
+        stamps = self._stamps()
+
+        while not self._stop_event.wait(self.poll_interval):
+            current = self._stamps()
+
+            for name in current.keys() | stamps.keys():
+                if current.get(name) != stamps.get(name):
+                    self._changed(name)
+
+            stamps = current
+
+    def _stamps(self) -> dict[str, tuple[int, int]]:
+        """
+        Get the modification time and size of every watched file in the directory
+
+        :return: The stamps, keyed by file name
+        """
+        stamps = {}
+
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(self.suffixes):
+                        try:
+                            stat = entry.stat()
+                            stamps[entry.name] = (stat.st_mtime_ns, stat.st_size)
+                        except OSError:
+                            pass
+        except OSError as e:
+            self.logger.error(f"Failed to scan {self.directory}: {e}")
+
+        return stamps